@@ -0,0 +1,5 @@
+from lib.cli import main
+import sys
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+'''Times and memory-profiles each stage of the analysis on synthetic corpora, and flags regressions
+against a stored baseline.
+
+Run from the repository root:
+    python -m benchmarks.pipeline [--preset quick|standard|full] [--kinds ...] [--sizes ...] [--documents ...]
+                                  [--repeat N] [--no-memory] [-o results.json] [--compare baseline.json]
+    python -m benchmarks.pipeline --results results.json --compare baseline.json
+
+Corpora are generated deterministically from a seed, so runs on different commits analyse the same
+texts: English-like spaced text, Japanese-like unspaced text, highly repetitive boilerplate, one
+sentence repeated over and over without spaces, and English-like text with a long passage in it three
+times, where repeats are as long as the text or the passage. A
+case is one kind of corpus at a total size in characters (10KB to 50MB) split over 1 to 1,000
+documents. Every case runs these stages in order, each timed separately:
+
+stree_build: building the suffix tree of every document.
+get_repeats: SubstringAnalyser.load in this process, which finds the repeats of every document.
+load_common: finding the common substrings with a generalised suffix tree.
+get_output: draining the output generators of every document and of the common substrings.
+save_output: writing the xlsx workbook.
+
+Times are the best of --repeat runs. Peak memory is measured with tracemalloc in one more run, as
+tracing slows everything down. Results are written as JSON, and with --compare a stage which is slower
+or uses more memory than the baseline by more than the thresholds is reported, and the exit status is 1.'''
+from lib.ptrus_suffix_trees.STree import STree
+from lib.substring_analyser import SubstringAnalyser
+from contextlib import redirect_stdout
+from pathlib import Path
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+KINDS = ('english', 'japanese', 'boilerplate', 'periodic', 'duplicated')
+UNSPACED = ('japanese', 'periodic')
+STAGES = ('stree_build', 'get_repeats', 'load_common', 'get_output', 'save_output')
+PRESETS = {'quick' : (['10KB', '100KB'], [1, 10]),
+           'standard' : (['1MB', '10MB'], [10, 100]),
+           'full' : (['10KB', '1MB', '10MB', '50MB'], [1, 10, 100, 1000])}
+UNITS = {'KB' : 1000, 'MB' : 1000 ** 2, 'GB' : 1000 ** 3}
+
+def parse_size(size):
+    '''Parses sizes such as 10KB or 50MB into a number of characters.'''
+    size = size.strip().upper()
+    for unit, factor in UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+def format_size(size):
+    for unit, factor in reversed(list(UNITS.items())):
+        if size >= factor and size % factor == 0:
+            return '{}{}'.format(size // factor, unit)
+    return str(size)
+
+def zipf_weights(n):
+    '''Returns cumulative Zipf weights for n words, the most frequent first.'''
+    return list(itertools.accumulate(1 / rank for rank in range(1, n + 1)))
+
+def english_text(size, seed=0):
+    '''Sentences of words drawn from a Zipf distribution over 5000 made-up words, with commas,
+full stops and paragraphs, like running English text.'''
+    r = random.Random(seed)
+    letters = 'etaoinshrdlcumwfgypbvkjxqz'
+    words = [''.join(r.choice(letters[:12] if i < 100 else letters) for _ in range(r.randint(1, 4) if i < 100 else r.randint(3, 10)))
+             for i in range(5000)]
+    weights = zipf_weights(len(words))
+    parts = []
+    length = 0
+    while length < size:
+        sentence = r.choices(words, cum_weights=weights, k=r.randint(5, 25))
+        if len(sentence) > 10:
+            sentence[r.randrange(3, len(sentence) - 3)] += ','
+        sentence = ' '.join(sentence).capitalize() + ('.\n' if r.random() < 0.2 else '. ')
+        parts.append(sentence)
+        length += len(sentence)
+    return ''.join(parts)[:size]
+
+def japanese_text(size, seed=0):
+    '''Sentences of kanji compounds, katakana loanwords and hiragana particles and endings, with
+読点 and 句点, like unspaced Japanese text.'''
+    r = random.Random(seed)
+    kanji = [chr(0x4e00 + r.randrange(0x5000)) for _ in range(2000)]
+    katakana = [chr(c) for c in range(0x30a2, 0x30f3)]
+    words = [''.join(r.choice(kanji) for _ in range(r.choice((1, 2, 2, 2, 3, 4)))) for _ in range(6000)]
+    words += [''.join(r.choice(katakana) for _ in range(r.randint(2, 6))) + 'ー' * r.randint(0, 1) for _ in range(1000)]
+    r.shuffle(words)
+    weights = zipf_weights(len(words))
+    particles = ['の', 'は', 'を', 'に', 'が', 'で', 'と', 'から', 'まで', 'について', 'による']
+    endings = ['する。', 'した。', 'である。', 'ます。', 'ました。', 'とする。', 'を行う。']
+    parts = []
+    length = 0
+    while length < size:
+        sentence = []
+        for i in range(r.randint(2, 8)):
+            sentence.append(''.join(r.choices(words, cum_weights=weights, k=r.randint(1, 3))))
+            sentence.append(r.choice(particles))
+            if r.random() < 0.15:
+                sentence.append('、')
+        sentence.append(r.choice(endings))
+        if r.random() < 0.2:
+            sentence.append('\n')
+        sentence = ''.join(sentence)
+        parts.append(sentence)
+        length += len(sentence)
+    return ''.join(parts)[:size]
+
+def boilerplate_text(size, seed=0):
+    '''Numbered clauses taken from a few dozen templates with a handful of names and numbers filled
+in, like contracts and manuals, where most of the text repeats.'''
+    r = random.Random(seed)
+    templates = english_text(12000, seed + 1).split('. ')[:40]
+    names = ['the Company', 'the Contractor', 'the Licensee', 'each Party', 'the Supplier']
+    parts = []
+    length = 0
+    clause = 1
+    while length < size:
+        words = r.choice(templates).split(' ')
+        words.insert(r.randrange(len(words) + 1), r.choice(names))
+        text = '{}.{} {} within {} days.\n'.format(clause // 10 + 1, clause % 10 + 1, ' '.join(words), r.choice((7, 14, 30, 60, 90)))
+        parts.append(text)
+        length += len(text)
+        clause += 1
+    return ''.join(parts)[:size]
+
+def periodic_text(size, seed=0):
+    '''One short sentence over and over, so the text repeats itself from every position.'''
+    sentence = english_text(200, seed).split('. ')[0] + '. '
+    return (sentence * (size // len(sentence) + 1))[:size]
+
+def duplicated_text(size, seed=0):
+    '''English-like text with one passage, a quarter of the text, pasted in three times, like a document
+which quotes the same section in several places.'''
+    passage = english_text(size // 4, seed + 1)
+    return ''.join(english_text(size // 12, seed + 2 + i) + passage for i in range(3))[:size]
+
+GENERATORS = {'english' : english_text, 'japanese' : japanese_text, 'boilerplate' : boilerplate_text,
+              'periodic' : periodic_text, 'duplicated' : duplicated_text}
+
+def corpus(kind, size, documents, seed=0):
+    '''Returns documents (filename, text) tuples of the given kind, of size characters in total.'''
+    generate = GENERATORS[kind]
+    sizes = [size // documents + (1 if i < size % documents else 0) for i in range(documents)]
+    return [('{}{}.txt'.format(kind, i), generate(s, seed + i)) for i, s in enumerate(sizes)]
+
+def run_stages(texts, spaced, directory):
+    '''Runs every stage on texts once, and yields (stage, function) pairs for the caller to time or
+profile. Each function does the work of its stage on the state left by the ones before.'''
+    sa = SubstringAnalyser(spaced=spaced, max_workers=1) # In this process, so tracemalloc sees it
+    sink = io.StringIO()
+
+    def stree_build():
+        for name, text in texts:
+            STree(sa.encode(text))
+
+    def get_repeats():
+        with redirect_stdout(sink):
+            sa.load(list(texts))
+
+    def load_common():
+        with redirect_stdout(sink):
+            sa.load_common()
+
+    results = {}
+    def get_output():
+        results['common'] = list(sa.common['results']) # Kept so the output can be restarted for saving
+        for d in [sa.common] + sa.data:
+            for row in d['output']:
+                pass
+
+    def save_output():
+        sa.common['results'] = results['common']
+        sa.common['clean_results'] = []
+        sa.common['output'] = sa.get_output(sa.common)
+        for d in sa.data:
+            sa.filter(d)
+        sa.save_output(str(Path(directory, 'benchmark.xlsx')))
+
+    yield from zip(STAGES, (stree_build, get_repeats, load_common, get_output, save_output))
+
+def run_case(kind, size, documents, repeat=1, memory=True, seed=0):
+    '''Returns the results of one case: the corpus, and for every stage its best time in seconds
+and, with memory, the peak memory traced while it ran.'''
+    texts = corpus(kind, size, documents, seed)
+    spaced = kind not in UNSPACED
+    stages = {stage : {} for stage in STAGES}
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(repeat):
+            for stage, f in run_stages(texts, spaced, directory):
+                start = time.perf_counter()
+                f()
+                seconds = time.perf_counter() - start
+                stages[stage]['seconds'] = min(seconds, stages[stage].get('seconds', seconds))
+        if memory:
+            tracemalloc.start()
+            try:
+                for stage, f in run_stages(texts, spaced, directory):
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    f()
+                    stages[stage]['peak_bytes'] = tracemalloc.get_traced_memory()[1] - before
+            finally:
+                tracemalloc.stop()
+    return {'name' : '{}-{}-{}'.format(kind, format_size(size), documents), 'kind' : kind, 'size' : size,
+            'documents' : documents, 'spaced' : spaced, 'stages' : stages}
+
+def compare(baseline, results, time_threshold=0.2, memory_threshold=0.2, min_seconds=0.05):
+    '''Returns a message for every stage of a case in both results which takes more than time_threshold
+longer (and at least min_seconds longer, as shorter differences are noise) or peaks more than
+memory_threshold higher than in the baseline.'''
+    base = {case['name'] : case['stages'] for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        for stage, new in case['stages'].items():
+            old = base.get(case['name'], {}).get(stage)
+            if old == None:
+                continue
+            if 'seconds' in old and 'seconds' in new and new['seconds'] > old['seconds'] * (1 + time_threshold) \
+                    and new['seconds'] - old['seconds'] >= min_seconds:
+                regressions.append('{} {}: {:.3f}s, was {:.3f}s ({:+.0%})'.format(
+                    case['name'], stage, new['seconds'], old['seconds'], new['seconds'] / old['seconds'] - 1))
+            if old.get('peak_bytes') and 'peak_bytes' in new and new['peak_bytes'] > old['peak_bytes'] * (1 + memory_threshold):
+                regressions.append('{} {}: peak {:,} bytes, was {:,} ({:+.0%})'.format(
+                    case['name'], stage, new['peak_bytes'], old['peak_bytes'], new['peak_bytes'] / old['peak_bytes'] - 1))
+    return regressions
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.pipeline', description='Benchmarks each stage of the analysis.')
+    parser.add_argument('--preset', choices=list(PRESETS), default='quick', help='sizes and document counts to run (default: %(default)s)')
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--sizes', nargs='+', help='total corpus sizes, such as 10KB or 50MB, instead of the preset')
+    parser.add_argument('--documents', nargs='+', type=int, help='numbers of documents, instead of the preset')
+    parser.add_argument('--repeat', type=int, default=1, help='runs to take the best time of')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="don't measure peak memory")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='file to write the results to (default: stdout)')
+    parser.add_argument('--results', help='compare these saved results instead of running the benchmarks')
+    parser.add_argument('--compare', help='baseline results to flag regressions against')
+    parser.add_argument('--time-threshold', type=float, default=0.2, help='fraction slower which counts as a regression')
+    parser.add_argument('--memory-threshold', type=float, default=0.2, help='fraction more memory which counts as a regression')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.results:
+        with open(args.results, encoding='utf-8') as f:
+            results = json.load(f)
+    else:
+        sizes, documents = PRESETS[args.preset]
+        sizes = [parse_size(s) for s in args.sizes or sizes]
+        documents = args.documents or documents
+        results = {'python' : platform.python_version(), 'platform' : platform.platform(), 'cpus' : os.cpu_count(), 'cases' : []}
+        for kind, size, n in itertools.product(args.kinds, sizes, documents):
+            if n > size:
+                continue
+            case = run_case(kind, size, n, args.repeat, args.memory, args.seed)
+            results['cases'].append(case)
+            print('{:<24}'.format(case['name']) + ''.join(' {} {:.3f}s'.format(stage, s['seconds'])
+                  for stage, s in case['stages'].items()), file=sys.stderr, flush=True)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=1)
+        else:
+            json.dump(results, sys.stdout, indent=1)
+            print()
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), results, args.time_threshold, args.memory_threshold)
+        for r in regressions:
+            print('REGRESSION ' + r, file=sys.stderr)
+        print('{} regressions against {}'.format(len(regressions), args.compare), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
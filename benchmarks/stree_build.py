@@ -0,0 +1,31 @@
+'''Times suffix tree construction on large-alphabet inputs.
+
+Run from the repository root:
+    python -m benchmarks.stree_build [size ...]'''
+import random
+import re
+import sys
+import time
+from lib.ptrus_suffix_trees.STree import STree
+
+def unspaced_text(size, seed=0):
+    '''Random text over 5000 CJK ideographs, like a kanji-heavy document.'''
+    r = random.Random(seed)
+    return ''.join(chr(0x4e00 + r.randrange(5000)) for _ in range(size))
+
+def spaced_tokens(size, seed=0):
+    '''Token list over a 20000-word vocabulary, split the way spaced texts are.'''
+    r = random.Random(seed)
+    vocab = ['w{}'.format(i) for i in range(20000)]
+    return re.split('( )', ' '.join(r.choice(vocab) for _ in range(size // 2)))
+
+def time_build(x):
+    start = time.perf_counter()
+    STree(x)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 50000]
+    for size in sizes:
+        print('unspaced {:>9} symbols: {:8.2f}s'.format(size, time_build(unspaced_text(size))))
+        print('spaced   {:>9} symbols: {:8.2f}s'.format(size, time_build(spaced_tokens(size))))
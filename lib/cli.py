@@ -0,0 +1,153 @@
+'''Command line entry point, which does the same work as the GUI without tkinter or win32com:
+extracts the text of every input file, analyses it and saves the output.
+
+usage: python TermExtractorCLI.py [options] input [input ...]
+
+Inputs can be files, directories (every supported file directly inside them) or glob patterns,
+including ** patterns. Options default to the USER section of config.ini. Progress goes to stderr,
+with the time, size and throughput of every stage of the analysis, and the exit status is 1 if any file could not be extracted or analysed, 2 for bad arguments.'''
+from lib.text_extractor import TextExtractor
+from lib.extraction_cache import ExtractionCache
+from lib.substring_analyser import SubstringAnalyser, ENGINES, MODES, SCORES, TERMHOOD
+from lib.instrumentation import PROFILERS, describe
+from configparser import ConfigParser
+from contextlib import redirect_stdout
+from pathlib import Path
+import argparse
+import glob
+import sys
+import time
+
+SUPPORTED = ('.txt', '.csv', '.xml', '.html', '.htm', '.rtf', '.docx', '.doc', '.pdf', '.xls', '.xlsx', '.pptx', '.ppt')
+
+def find_files(inputs):
+    '''Expands input files, directories and glob patterns into a sorted list of unique paths.'''
+    files = []
+    for i in inputs:
+        p = Path(i)
+        if p.is_dir():
+            files.extend(f for f in p.iterdir() if f.is_file() and f.suffix.lower() in SUPPORTED)
+        elif p.is_file():
+            files.append(p)
+        else:
+            files.extend(Path(f) for f in glob.glob(i, recursive=True) if Path(f).is_file())
+    return sorted(set(files))
+
+def parse_args(argv, config):
+    parser = argparse.ArgumentParser(prog='TermExtractorCLI', description='Extracts repeated and common terms from documents.')
+    parser.add_argument('inputs', nargs='+', help='files, directories or glob patterns')
+    parser.add_argument('-o', '--output', default=str(Path(config.get('output_path', 'output'), 'extracted_terms.xlsx'))
+                        , help='output file; xlsx, csv, jsonl or col, by extension (default: %(default)s)')
+    parser.add_argument('--format', help='output format, if it is not the extension of the output file')
+    parser.add_argument('--min-length', type=int, default=config.getint('min_length', 2))
+    parser.add_argument('--min-occurrences', type=int, default=config.getint('min_occurrences', 2))
+    parser.add_argument('--spaced', action=argparse.BooleanOptionalAction, default=config.getboolean('spaced', False)
+                        , help='whether words are split by spaces (use --no-spaced for Japanese)')
+    parser.add_argument('--engine', choices=list(ENGINES), default=config.get('engine', 'stree'))
+    parser.add_argument('--mode', choices=MODES, default=config.get('mode', 'maximal'))
+    parser.add_argument('--top-k', type=int, default=config.getint('top_k', 0) or None
+                        , help='keep only the K highest scoring repeats of each text')
+    parser.add_argument('--score', choices=list(SCORES), default=config.get('score', 'occurrences'), help='score for --top-k')
+    parser.add_argument('--termhood', choices=TERMHOOD, default=config.get('termhood', 'cvalue')
+                        , help='termhood score of every repeat in the output, also used by --score termhood')
+    parser.add_argument('--shard-size', type=int, default=config.getint('shard_size', 0) or None
+                        , help='analyse texts of more symbols than this in shards, in parallel, extracting files as they are analysed')
+    parser.add_argument('--max-term-length', type=int, default=config.getint('max_term_length', 32)
+                        , help='longest repeat found in sharded texts, in symbols (default: %(default)s)')
+    parser.add_argument('-j', '--workers', type=int, default=config.getint('max_workers', 0) or None
+                        , help='parallel workers for extraction and analysis (default: every CPU)')
+    parser.add_argument('--page-workers', type=int, default=config.getint('page_workers', 1)
+                        , help='processes to extract each pdf of more than {} pages with (default: %(default)s)'.format(TextExtractor.PAGES_PER_TASK))
+    parser.add_argument('--cache', default=config.get('cache_path', ''), help='extraction cache directory (default: %(default)s)')
+    parser.add_argument('--no-cache', dest='cache', action='store_const', const='', help="don't cache extracted texts")
+    parser.add_argument('--cache-mb', type=int, default=config.getint('cache_mb', 512), help='extraction cache size limit')
+    parser.add_argument('--index', default=config.get('index_path', ''), help='directory of saved repeat indexes (default: %(default)s)')
+    parser.add_argument('--no-index', dest='index', action='store_const', const='', help="don't save or reuse repeat indexes")
+    parser.add_argument('--no-common', dest='common', action='store_false', help="don't find common substrings")
+    parser.add_argument('--profile', choices=PROFILERS, help='profile every stage with cProfile or tracemalloc')
+    parser.add_argument('--profile-path', default='profiles', help='directory to save profiles in (default: %(default)s)')
+    return parser.parse_args(argv)
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+def stream(te, filepath, i, total, chars, start):
+    '''Yields the text of a file in blocks from te.extract_chunks, for SubstringAnalyser.load to read as they are
+extracted, and logs the file once it has been read, adding its characters to chars[0].'''
+    n = 0
+    try:
+        for block in te.extract_chunks(filepath):
+            n = n + len(block)
+            yield block
+    except Exception as e:
+        log('[{}/{}] Error opening file "{}": {}'.format(i, total, filepath, e))
+        raise
+    chars[0] = chars[0] + n
+    log('[{}/{}] Extracted {} ({:,} characters, {:,.0f} characters/s)'.format(i, total, filepath, n, chars[0] / (time.perf_counter() - start)))
+
+def main(argv=None, config_path='config.ini'):
+    config_parser = ConfigParser()
+    config_parser.read(config_path, encoding='utf-8-sig')
+    args = parse_args(argv, config_parser['USER'] if config_parser.has_section('USER') else config_parser['DEFAULT'])
+    failed = False
+    start = time.perf_counter()
+
+    files = find_files(args.inputs)
+    if not files:
+        log('No input files found.')
+        return 1
+
+    cache = ExtractionCache(args.cache, args.cache_mb * 1024 * 1024, TextExtractor.VERSION) if args.cache else None
+    te = TextExtractor(cache, page_workers=args.page_workers, profile=args.profile, profile_path=args.profile_path)
+    chars = [0] # Added to as texts are extracted
+    if args.shard_size: # Texts are extracted one at a time as they are analysed, so sharded ones are never held whole
+        data = [(f.name, stream(te, f, i, len(files), chars, start)) for i, f in enumerate(files, 1)]
+    else:
+        texts = {}
+        for i, (f, text, error) in enumerate(te.extract_many(files, max_workers=args.workers), 1):
+            if error:
+                log('[{}/{}] Error opening file "{}": {}'.format(i, len(files), f, error))
+                failed = True
+                continue
+            texts[f] = text
+            chars[0] = chars[0] + len(text)
+            elapsed = time.perf_counter() - start
+            log('[{}/{}] Extracted {} ({:,} characters, {:,.0f} characters/s)'.format(i, len(files), f, len(text), chars[0] / elapsed))
+        if cache:
+            log('Extraction cache: {hits} hits, {misses} misses, {hashed} files hashed'.format(**cache.stats()))
+        data = [(f.name, texts[f]) for f in files if f in texts] # In input order, whichever finished first
+        if not data:
+            return 1
+
+    analysis_start = time.perf_counter()
+    sa = SubstringAnalyser(min_length=args.min_length, min_occurrences=args.min_occurrences, spaced=args.spaced
+                           , engine=args.engine, mode=args.mode, max_workers=args.workers, index_path=args.index or None
+                           , observer=lambda event: log(describe(event)), profile=args.profile, profile_path=args.profile_path
+                           , top_k=args.top_k, score=args.score, termhood=args.termhood
+                           , shard_size=args.shard_size, max_term_length=args.max_term_length)
+    try:
+        with redirect_stdout(sys.stderr): # Other messages are progress too
+            try:
+                sa.load(data)
+            except Exception as e: # Texts which failed are listed, and the rest are still saved
+                log(e)
+                failed = True
+            if args.shard_size:
+                te.cleanup()
+                if cache:
+                    log('Extraction cache: {hits} hits, {misses} misses, {hashed} files hashed'.format(**cache.stats()))
+            if args.common:
+                sa.load_common()
+        elapsed = time.perf_counter() - analysis_start
+        log('Analysed {} texts ({:,} characters) in {:.1f}s ({:,.0f} characters/s)'.format(len(data), chars[0], elapsed, chars[0] / elapsed))
+
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        sa.export(args.output, args.format)
+    except Exception as e:
+        log('Error: {}'.format(e))
+        return 1
+    log('Output saved to {} in {:.1f}s'.format(args.output, time.perf_counter() - start))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+try:
+    popcount = int.bit_count
+except AttributeError: # Python < 3.10
+    def popcount(mask):
+        return bin(mask).count('1')
+
+class DocumentSet():
+    '''A set of text indexes kept as the bits of one int, used to label common substrings.
+Union is a single |, and len is a popcount, so the number of texts is known without
+building a set. Iterates in ascending order and prints like a set, so it can stand in
+for the sets common substring results used to hold.'''
+    __slots__ = ('mask',)
+
+    def __init__(self, mask=0):
+        self.mask = mask
+
+    @classmethod
+    def of(cls, idxs):
+        '''Builds a DocumentSet from an iterable of text indexes.'''
+        mask = 0
+        for i in idxs:
+            mask |= 1 << i
+        return cls(mask)
+
+    def __len__(self):
+        return popcount(self.mask)
+
+    def __iter__(self):
+        mask = self.mask
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def __contains__(self, i):
+        return i >= 0 and (self.mask >> i) & 1 == 1
+
+    def __or__(self, other):
+        return DocumentSet(self.mask | other.mask)
+
+    def issuperset(self, other):
+        return self.mask & other.mask == other.mask
+
+    def __eq__(self, other):
+        if isinstance(other, DocumentSet):
+            return self.mask == other.mask
+        return set(self) == other
+
+    def __hash__(self):
+        return hash(self.mask)
+
+    def __repr__(self):
+        return '{' + ', '.join(str(i) for i in self) + '}'
@@ -0,0 +1,187 @@
+from array import array
+import csv
+import json
+from math import isnan
+import struct
+import sys
+
+NAN = float('nan')
+
+COLUMNS = ('document', 'substring', 'occurrences', 'documents', 'length', 'score')
+
+class Exporter():
+    '''Writes rows of output to a file at path as they are produced. Rows are tuples in COLUMNS order:
+repeats have the document name, their occurrences and their termhood score, and common substrings
+have the list of names of the documents they appear in. The missing value is None. Exporters are context managers:
+
+with CSVExporter(path) as exporter:
+    for row in rows:
+        exporter.write(row)'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        self.file = open(self.path, 'w', encoding='utf-8', newline='')
+
+    def write(self, row):
+        raise NotImplementedError
+
+    def close(self):
+        self.file.close()
+
+class CSVExporter(Exporter):
+    '''Comma separated values with a header row. Document names of common substrings are joined by "; ".'''
+
+    def open(self):
+        super().open()
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, row):
+        document, substring, occurrences, documents, length, score = row
+        if documents is not None:
+            documents = '; '.join(documents)
+        self.writer.writerow((document, substring, occurrences, documents, length, score))
+
+class JSONLinesExporter(Exporter):
+    '''One JSON object per line, leaving out the missing values.'''
+
+    def write(self, row):
+        obj = {k: v for k, v in zip(COLUMNS, row) if v is not None}
+        self.file.write(json.dumps(obj, ensure_ascii=False))
+        self.file.write('\n')
+
+class ColumnarExporter(Exporter):
+    '''Compact binary format, read back with read_columnar. Rows are buffered into blocks of at most
+BLOCK_ROWS and each block is written column by column, so memory doesn't grow with the output.
+
+The file starts with MAGIC, followed by blocks of little-endian values:
+uint32 rows, then the names first used in this block as strings (see _write_strings),
+int32[rows] document ids (-1 for none), the substrings as strings, int64[rows] occurrences (-1 for none),
+uint32[rows] document counts followed by int32 document ids for each row, uint32[rows] lengths and
+float64[rows] scores (NaN for none). Document ids count names in the order they first appear in the file.
+Files from before scores were added start with MAGIC_V1 and have no scores.'''
+
+    MAGIC = b'TXCOL2\n'
+    MAGIC_V1 = b'TXCOL1\n'
+    BLOCK_ROWS = 65536
+
+    def open(self):
+        self.file = open(self.path, 'wb')
+        self.file.write(self.MAGIC)
+        self.names = {}
+        self.new_names = []
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) == self.BLOCK_ROWS:
+            self.flush()
+
+    def close(self):
+        if self.rows:
+            self.flush()
+        self.file.close()
+
+    def name_id(self, name):
+        '''Returns the id of a document name, adding it to the names of the current block if it is new.'''
+        if name not in self.names:
+            self.names[name] = len(self.names)
+            self.new_names.append(name)
+        return self.names[name]
+
+    def flush(self):
+        '''Writes the buffered rows as one block.'''
+        rows = self.rows
+        document = array('i', (-1 if r[0] is None else self.name_id(r[0]) for r in rows))
+        occurrences = array('q', (-1 if r[2] is None else r[2] for r in rows))
+        counts = array('I', (0 if r[3] is None else len(r[3]) for r in rows))
+        documents = array('i', (self.name_id(n) for r in rows if r[3] is not None for n in r[3]))
+        length = array('I', (r[4] for r in rows))
+        score = array('d', (NAN if r[5] is None else r[5] for r in rows))
+
+        f = self.file
+        f.write(struct.pack('<I', len(rows)))
+        _write_strings(f, self.new_names)
+        _write_array(f, document)
+        _write_strings(f, [r[1] for r in rows])
+        _write_array(f, occurrences)
+        _write_array(f, counts)
+        _write_array(f, documents)
+        _write_array(f, length)
+        _write_array(f, score)
+        self.new_names = []
+        self.rows = []
+
+def _write_array(f, a):
+    '''Writes an array in little-endian byte order.'''
+    if sys.byteorder == 'big':
+        a = array(a.typecode, a)
+        a.byteswap()
+    a.tofile(f)
+
+def _read_array(f, typecode, n):
+    '''Reads n little-endian values of typecode.'''
+    a = array(typecode)
+    a.fromfile(f, n)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+def _write_strings(f, strings):
+    '''Writes uint32 count, uint32 byte lengths, then the strings encoded as utf-8.'''
+    encoded = [s.encode('utf-8') for s in strings]
+    f.write(struct.pack('<I', len(encoded)))
+    _write_array(f, array('I', (len(b) for b in encoded)))
+    f.write(b''.join(encoded))
+
+def _read_strings(f):
+    '''Reads a list of strings written by _write_strings.'''
+    n = struct.unpack('<I', f.read(4))[0]
+    lengths = _read_array(f, 'I', n)
+    blob = f.read(sum(lengths))
+    strings = []
+    start = 0
+    for l in lengths:
+        strings.append(blob[start:start + l].decode('utf-8'))
+        start = start + l
+    return strings
+
+def read_columnar(path):
+    '''Yields the rows of a file written by ColumnarExporter, one block at a time.'''
+    with open(path, 'rb') as f:
+        magic = f.read(len(ColumnarExporter.MAGIC))
+        if magic not in (ColumnarExporter.MAGIC, ColumnarExporter.MAGIC_V1):
+            raise Exception('{} is not a columnar export.'.format(path))
+        names = []
+        while True:
+            header = f.read(4)
+            if not header:
+                break
+            n = struct.unpack('<I', header)[0]
+            names.extend(_read_strings(f))
+            document = _read_array(f, 'i', n)
+            substring = _read_strings(f)
+            occurrences = _read_array(f, 'q', n)
+            counts = _read_array(f, 'I', n)
+            documents = _read_array(f, 'i', sum(counts))
+            length = _read_array(f, 'I', n)
+            score = _read_array(f, 'd', n) if magic == ColumnarExporter.MAGIC else array('d', [NAN]) * n
+            d = 0
+            for i in range(n):
+                ids = None
+                if counts[i] or document[i] == -1:
+                    ids = [names[j] for j in documents[d:d + counts[i]]]
+                    d = d + counts[i]
+                yield (names[document[i]] if document[i] != -1 else None, substring[i],
+                       occurrences[i] if occurrences[i] != -1 else None, ids, length[i], None if isnan(score[i]) else score[i])
+
+EXPORTERS = {'csv' : CSVExporter, 'jsonl' : JSONLinesExporter, 'col' : ColumnarExporter}
@@ -0,0 +1,128 @@
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+import zlib
+
+class ExtractionCache():
+    '''On-disk cache of extracted texts, keyed by a hash of the file contents, file type and extractor version.
+
+Texts are stored zlib-compressed in texts/<key>. Reading an entry touches its modification time, and
+once the texts take more than max_bytes the least recently used ones are deleted. Every file is written
+to a temporary file and renamed into place, so processes can share the cache without locks: an entry
+is either complete or missing, and a missing entry is just a miss.
+
+To avoid hashing unchanged files, paths/<hash of the path> records the path's size, modification time,
+the version it was hashed for and key, which is reused while all three are the same.
+
+hits, misses and hashed count cache hits, cache misses and files which had to be hashed.'''
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, version=0):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.hashed = 0
+        (self.path / 'texts').mkdir(parents=True, exist_ok=True)
+        (self.path / 'paths').mkdir(parents=True, exist_ok=True)
+
+    def extract(self, filepath, extractor):
+        '''Returns the cached text of filepath, or calls extractor() and caches the text it returns.'''
+        key = self.key(filepath)
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        text = extractor()
+        self.put(key, text)
+        return text
+
+    def key(self, filepath):
+        '''Returns the key for the current contents of filepath.'''
+        stat = os.stat(filepath)
+        source = str(Path(filepath).resolve())
+        record = self.path / 'paths' / hashlib.sha1(source.encode('utf-8')).hexdigest()
+        try:
+            with record.open('r', encoding='utf-8') as f:
+                size, mtime, version, key, recorded = f.read().split('\n', 4)
+            if (int(size), int(mtime), version, recorded) == (stat.st_size, stat.st_mtime_ns, str(self.version), source):
+                return key
+        except (OSError, ValueError):
+            pass
+
+        self.hashed += 1
+        h = hashlib.sha256('{}\n{}\n'.format(self.version, Path(filepath).suffix.lower()).encode('utf-8'))
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        key = h.hexdigest()
+        self.write(record, '{}\n{}\n{}\n{}\n{}'.format(stat.st_size, stat.st_mtime_ns, self.version, key, source).encode('utf-8'))
+        return key
+
+    def get(self, key):
+        '''Returns the cached text for key, or None.'''
+        entry = self.path / 'texts' / key
+        try:
+            with entry.open('rb') as f:
+                text = zlib.decompress(f.read()).decode('utf-8')
+            os.utime(entry)
+        except (OSError, zlib.error):
+            return None
+        return text
+
+    def put(self, key, text):
+        '''Caches text for key, then evicts the least recently used texts over max_bytes.'''
+        self.write(self.path / 'texts' / key, zlib.compress(text.encode('utf-8')))
+        self.evict()
+
+    def write(self, path, data):
+        '''Writes data to a temporary file next to path, then renames it over path. Failures are
+ignored, as another process may be replacing the same file, and the cache is only a cache.'''
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def evict(self):
+        '''Deletes the least recently used texts until they take at most max_bytes.'''
+        entries = []
+        total = 0
+        for entry in os.scandir(self.path / 'texts'):
+            if entry.name.startswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError: # Evicted by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def __reduce__(self):
+        '''Copies sent to worker processes start with their own counters at zero.'''
+        return (ExtractionCache, (self.path, self.max_bytes, self.version))
+
+    def merge(self, stats):
+        '''Adds the counters of a copy of this cache, as returned by its stats().'''
+        self.hits += stats['hits']
+        self.misses += stats['misses']
+        self.hashed += stats['hashed']
+
+    def stats(self):
+        '''Returns the counters as a dictionary.'''
+        return {'hits' : self.hits, 'misses' : self.misses, 'hashed' : self.hashed}
@@ -0,0 +1,140 @@
+'''Events about the progress and cost of each stage of extraction and analysis, for progress bars,
+logs and profiling.
+
+An observer is any callable taking one event, a dictionary with:
+stage: 'extract', 'repeats', 'common' or 'save'.
+seconds: how long the stage took, in the process which did the work.
+peak_rss: the peak resident memory of that process in bytes, or None where it can't be read.
+And where they apply:
+document, filename: the position and name of the text or file.
+done, total: how many of the stage's texts have finished, out of how many.
+characters: characters extracted.
+tokens: symbols analysed (characters, or words and punctuation for spaced texts).
+nodes: nodes of the suffix tree, or suffixes of the suffix array.
+shards: how many shards a text too large to analyse at once was split into.
+results: results at the current thresholds, or rows saved.
+cached: True if the result was read from a cache instead.
+error: the exception the stage failed with.
+profile: the file the stage's profile was saved to.
+traced_peak: the peak memory traced by tracemalloc while the stage ran.
+
+Observers are called from the thread doing the work, never from worker processes.'''
+from pathlib import Path
+import cProfile
+import sys
+import time
+import tracemalloc
+
+PROFILERS = ('cprofile', 'tracemalloc')
+
+def peak_rss():
+    '''Returns the peak resident set size of this process in bytes, or None if it can't be read.'''
+    try:
+        import resource
+    except ImportError: # Windows
+        return windows_peak_rss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # Bytes on macOS, kilobytes elsewhere
+
+def windows_peak_rss():
+    '''Returns the peak working set of this process from GetProcessMemoryInfo, or None.'''
+    try:
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [(name, ctypes.c_size_t) for name in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        return None
+
+class Stage():
+    '''Context manager which times the code in its block as one stage, and returns the stage's event
+for the block to add to. With profile, the block runs under cProfile or tracemalloc, and the profile
+is saved in profile_path as <stage>-<document or file name>.prof, for pstats, or .snapshot, for
+tracemalloc.Snapshot.load.'''
+
+    def __init__(self, stage, profile=None, profile_path=None, **fields):
+        if profile not in (None,) + PROFILERS:
+            raise Exception('Unknown profiler {}.'.format(profile))
+        self.event = dict(fields, stage=stage)
+        self.profile = profile
+        self.profile_path = profile_path
+
+    def __enter__(self):
+        if self.profile == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.profile == 'tracemalloc':
+            self.tracing = tracemalloc.is_tracing()
+            if not self.tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self.event
+
+    def __exit__(self, *exc_info):
+        self.event['seconds'] = time.perf_counter() - self.start
+        if self.profile == 'cprofile':
+            self.profiler.disable()
+            self.event['profile'] = self.path('.prof')
+            self.profiler.dump_stats(self.event['profile'])
+        elif self.profile == 'tracemalloc':
+            self.event['traced_peak'] = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            if not self.tracing:
+                tracemalloc.stop()
+            self.event['profile'] = self.path('.snapshot')
+            snapshot.dump(self.event['profile'])
+        self.event['peak_rss'] = peak_rss()
+        return False
+
+    def path(self, suffix):
+        directory = Path(self.profile_path or '.')
+        directory.mkdir(parents=True, exist_ok=True)
+        name = self.event.get('document')
+        if name == None and self.event.get('filename'):
+            name = Path(self.event['filename']).stem
+        name = self.event['stage'] if name == None else '{}-{}'.format(self.event['stage'], name)
+        return str(directory / (name + suffix))
+
+def print_loading(event):
+    '''The default observer of SubstringAnalyser, which prints the progress messages it always has.'''
+    if event['stage'] == 'repeats':
+        print('Loading {}'.format(event['document']))
+    elif event['stage'] == 'common':
+        print('Loading common')
+
+def describe(event):
+    '''Returns a line for logs describing an event, with its throughput.'''
+    parts = [event['stage']]
+    if event.get('total'):
+        parts.append('[{}/{}]'.format(event['done'], event['total']))
+    if event.get('filename'):
+        parts.append(str(event['filename']))
+    if 'error' in event:
+        return ' '.join(parts) + ' failed: {}'.format(event['error'])
+    if event.get('cached'):
+        parts.append('(cached)')
+    stats = []
+    seconds = event.get('seconds')
+    if seconds != None:
+        stats.append('{:.2f}s'.format(seconds))
+    for key in ('characters', 'tokens'):
+        if event.get(key) != None:
+            stats.append('{:,} {}'.format(event[key], key) + (' ({:,.0f}/s)'.format(event[key] / seconds) if seconds else ''))
+    for key in ('nodes', 'shards', 'results'):
+        if event.get(key) != None:
+            stats.append('{:,} {}'.format(event[key], key))
+    if event.get('peak_rss'):
+        stats.append('peak {:,.0f} MB'.format(event['peak_rss'] / 1024 ** 2))
+    if event.get('profile'):
+        stats.append('profile {}'.format(event['profile']))
+    return ' '.join(parts) + (': ' + ', '.join(stats) if stats else '')
@@ -0,0 +1,76 @@
+'''Reads plaintext files of unknown encoding, as a whole through a memory map or as a stream of blocks.
+
+The encoding is detected from the first SAMPLE_SIZE bytes: a byte order mark if there is one, otherwise
+UTF-8 if the sample is valid UTF-8, otherwise Shift-JIS (as Windows' cp932) if the sample decodes
+as mostly Japanese with kana, otherwise cp1252. Line endings are translated to \n, as in text mode.'''
+from codecs import BOM_UTF8, BOM_UTF16_LE, BOM_UTF16_BE, BOM_UTF32_LE, BOM_UTF32_BE, getincrementaldecoder
+import io
+import mmap
+
+SAMPLE_SIZE = 64 * 1024
+
+BOMS = ((BOM_UTF32_LE, 'utf-32'), (BOM_UTF32_BE, 'utf-32'), # UTF-32 first, as its LE mark starts with UTF-16's
+        (BOM_UTF8, 'utf-8-sig'), (BOM_UTF16_LE, 'utf-16'), (BOM_UTF16_BE, 'utf-16'))
+
+def decodes(sample, encoding):
+    '''Returns the decoded sample, or None if it isn't valid in encoding. A character cut off
+at the end of the sample is allowed.'''
+    try:
+        return getincrementaldecoder(encoding)().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return None
+
+def is_kana(c):
+    return '぀' <= c <= 'ヿ'
+
+def is_japanese(c):
+    return '　' <= c <= 'ヿ' or '一' <= c <= '鿿' or '＀' <= c <= '｠' # Not halfwidth katakana, which cp1252 text can decode to
+
+def detect_encoding(sample):
+    '''Returns the encoding of a file starting with the bytes in sample.'''
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if decodes(sample, 'utf-8') is not None:
+        return 'utf-8'
+    text = decodes(sample, 'cp932')
+    if text:
+        non_ascii = [c for c in text if c > '\x7f']
+        # cp1252 letters can pair up into kanji, but hardly ever into kana, which Japanese is full of
+        if sum(map(is_japanese, non_ascii)) > 0.8 * len(non_ascii) and sum(map(is_kana, non_ascii)) > 0.1 * len(non_ascii):
+            return 'cp932'
+    return 'cp1252'
+
+def newlines(text):
+    '''Translates \r\n and \r line endings to \n.'''
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def read_text(path):
+    '''Returns the text of the file at path, decoded in one pass over a memory map of the file.
+Falls back to cp1252 only if a detected UTF-8 file turns out to be invalid after the sample.'''
+    with open(path, 'rb') as f:
+        if f.seek(0, io.SEEK_END) == 0:
+            return '' # Empty files can't be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            encoding = detect_encoding(m[:SAMPLE_SIZE])
+            try:
+                text = str(m, encoding, 'strict' if encoding.startswith('utf') else 'replace')
+            except UnicodeDecodeError:
+                text = str(m, 'cp1252', 'replace')
+    return newlines(text)
+
+def iter_text(path, chunk_size=1 << 20):
+    '''Yields the text of the file at path in blocks of up to chunk_size characters, reading it once,
+for files too large to hold. Undecodable bytes past the sample are replaced, as blocks before them
+have already been yielded.'''
+    with open(path, 'rb') as f:
+        encoding = detect_encoding(f.read(SAMPLE_SIZE))
+        f.seek(0)
+        with io.TextIOWrapper(f, encoding=encoding, errors='replace', newline=None) as text:
+            while True:
+                block = text.read(chunk_size)
+                if not block:
+                    break
+                yield block
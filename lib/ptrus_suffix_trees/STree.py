@@ -23,21 +23,84 @@
 ##SOFTWARE.
 
 import sys
+from array import array
+from bisect import bisect_right
+from lib.document_set import DocumentSet
+
+# Nodes with more children than this keep them in a dict keyed by the first
+# symbol of the edge instead of the sibling list.
+_INDEX_FANOUT = 16
 
 class STree():
-    """Class representing the suffix tree."""
+    """Class representing the suffix tree.
+
+    Nodes are integer ids into parallel typed arrays (idx, depth, parent,
+    suffix link, first child, next sibling) instead of one Python object per
+    node. Each array holds 4-byte ints (8-byte once the input passes 2**30
+    symbols), so a node costs 24 bytes. A tree over n symbols has at most 2n
+    nodes, which bounds the tree at 48 bytes per input symbol (about 40 in
+    practice) on top of the input itself, against roughly 600 bytes per symbol
+    for the previous object-per-node layout.
+
+    Children are found by scanning the sibling list while a node has few of
+    them. Past _INDEX_FANOUT children the node moves them into a dict in
+    _child_index, so the root of a large-alphabet or spaced tree still has O(1)
+    child lookup. Such nodes have _first_child set to -2.
+
+    Once built, the leaves are numbered in depth-first order. Every node then
+    knows its number of leaves (leaf_count) and where its leaves start in that
+    order (_leaf_start), which costs 8 more bytes per node and 4 per leaf and
+    makes occurrence counts O(1) and find_all O(occurrences).
+
+    A generalized tree can also be changed in place: add_text continues the
+    construction over one more text, and remove_text takes a text's leaves
+    out again, using the leaf of every position kept in _leaves (4 bytes per
+    symbol, in generalized trees only). Either leaves the leaf numbering
+    stale, so leaf_count is only valid for trees which were built in one go,
+    and _get_leaves falls back to walking the subtree.
+    """
     def __init__(self, input='', gst=False):
-        self.root = _SNode()
-        self.root.depth = 0
-        self.root.idx = 0
-        self.root.parent = self.root
-        self.root._add_suffix_link(self.root)
+        self.texts = None
+        self._init_nodes(0)
 
         self._check_input(input)
 
         if not input == '':
            self.build(input, gst)
 
+    def _init_nodes(self, n):
+        """Allocates empty node arrays sized for an input of length n and
+        creates the root node (always node 0)."""
+        typecode = 'i' if 2 * n < 2**31 else 'q'
+        self.idx = array(typecode)
+        self.depth = array(typecode)
+        self.parent = array(typecode)
+        self._suffix_link = array(typecode)
+        self._first_child = array(typecode)
+        self._next_sibling = array(typecode)
+        self._child_index = {}
+        self.leaf_count = array(typecode)
+        self._leaf_start = array(typecode)
+        self._leaf_order = array(typecode)
+        self.generalized_masks = []
+        self._leaves = array(typecode)
+        self._leaves_indexed = False
+        self.root = self._new_node(0, 0)
+        self.parent[self.root] = self.root
+        self._add_suffix_link(self.root, self.root)
+
+    def _new_node(self, idx, depth, parent=-1):
+        """Appends a node to the arrays and returns its id."""
+        self.idx.append(idx)
+        self.depth.append(depth)
+        self.parent.append(parent)
+        self._suffix_link.append(-1)
+        self._first_child.append(-1)
+        self._next_sibling.append(-1)
+        if self.texts is not None:
+            self.generalized_masks.append(0)
+        return len(self.idx) - 1
+
     def _check_input(self, input):
         """Checks the validity of the input.
         In case of an invalid input throws ValueError.
@@ -46,6 +109,8 @@ class STree():
             return
         elif isinstance(input, list):
             return
+        elif isinstance(input, array): # Integer-encoded tokens
+            return
 
         raise ValueError("String argument should be of type String or List")
     
@@ -57,7 +122,11 @@ class STree():
         :param x: String or List of Strings
         """
         if not gst:
-            x += next(self._terminalSymbolsGenerator())
+            if isinstance(x, array):
+                x = x + array(x.typecode, [-1]) # Token ids are never negative
+            else:
+                terminal = next(self._terminalSymbolsGenerator())
+                x = x + (terminal if isinstance(x, str) else [terminal]) # Don't extend the caller's list
             self._build(x)
         else:
             self._build_generalized(x)
@@ -65,94 +134,227 @@ class STree():
     def _build(self, x):
         """Builds a Suffix tree."""
         self.word = x
+        self._init_nodes(len(x))
         self._build_McCreight(x)
+        self._index_leaves()
 
-    def _build_McCreight(self, x):
+    def _build_McCreight(self, x, start=0):
         """Builds a Suffix tree using McCreight O(n) algorithm.
 
         Algorithm based on:
         McCreight, Edward M. "A space-economical suffix tree construction algorithm." - ACM, 1976.
         Implementation based on:
         UH CS - 58093 String Processing Algorithms Lecture Notes
+
+        With start, the suffixes from start onwards are added to a tree which
+        already holds the suffixes before it. This is only valid where the
+        symbol before start is a unique terminal, so that every earlier
+        suffix has its own leaf and the head of suffix start is the root.
         """
+        idx = self.idx
+        depth = self.depth
         u = self.root
         d = 0
-        for i in range(len(x)):
-            while u.depth == d and u._has_transition(x[d+i]):
-                u = u._get_transition_link(x[d+i])
+        for i in range(start, len(x)):
+            while depth[u] == d:
+                v = self._get_transition_link(u, x[d+i])
+                if v == -1:
+                    break
+                u = v
                 d = d + 1
-                while d < u.depth and x[u.idx + d] == x[i + d]:
+                while d < depth[u] and x[idx[u] + d] == x[i + d]:
                     d = d + 1
-            if d < u.depth:
+            if d < depth[u]:
                 u = self._create_node(x, u, d)
             self._create_leaf(x, i, u, d)
-            if not u._get_suffix_link():
+            if self._get_suffix_link(u) == -1:
                 self._compute_slink(x, u)
-            u = u._get_suffix_link()
+            u = self._get_suffix_link(u)
             d = d - 1
             if d < 0:
                 d = 0
 
     def _create_node(self, x, u, d):
-        i = u.idx
-        p = u.parent
-        v = _SNode(idx=i, depth=d)
-        v._add_transition_link(u,x[i+d])
-        u.parent = v
-        p._add_transition_link(v, x[i+p.depth])
-        v.parent = p
+        i = self.idx[u]
+        p = self.parent[u]
+        v = self._new_node(i, d, p)
+        self._replace_transition_link(p, u, v)
+        self._add_transition_link(v, u)
+        self.parent[u] = v
+        if self.texts is not None: # Splitting an edge doesn't change which texts are below it
+            self.generalized_masks[v] = self.generalized_mask(u)
         return v
 
     def _create_leaf(self, x, i, u, d):
-        w = _SNode()
-        w.idx = i
-        w.depth = len(x) - i
-        u._add_transition_link(w, x[i + d])
-        w.parent = u
+        w = self._new_node(i, len(x) - i, u)
+        self._add_transition_link(u, w)
+        if self.texts is not None: # Leaves are created in order of position
+            self._leaves.append(w)
         return w
 
     def _compute_slink(self, x, u):
-        d = u.depth
-        v = u.parent._get_suffix_link()
-        while v.depth < d - 1:
-            v = v._get_transition_link(x[u.idx + v.depth + 1])
-        if v.depth > d - 1:
+        d = self.depth[u]
+        v = self._get_suffix_link(self.parent[u])
+        while self.depth[v] < d - 1:
+            v = self._get_transition_link(v, x[self.idx[u] + self.depth[v] + 1])
+        if self.depth[v] > d - 1:
             v = self._create_node(x, v, d-1)
-        u._add_suffix_link(v)
+        self._add_suffix_link(u, v)
 
     def _build_generalized(self, xs):
         """Builds a Generalized Suffix Tree (GST) from the array of strings provided.
-        """
-        terminal_gen = self._terminalSymbolsGenerator()
 
-        _xs = []
-        for x in xs:
-            _xs = _xs + list(x) + [next(terminal_gen)]
-        self.word = _xs
+        The texts are copied once into a preallocated int buffer: strings as
+        code points, token id arrays as they are and other sequences through a
+        shared token table. Text n is followed by the terminal -(n + 1), so the
+        number of texts is not limited by the size of the Private Use Area.
+        """
+        self.texts = list(xs)
         self._generalized_word_starts(xs)
+        _xs = array('i', bytes(4 * sum(len(x) + 1 for x in xs)))
+        ids = self._ids = {}
+        for n, x in enumerate(xs):
+            start = self.word_starts[n]
+            end = start + len(x)
+            if isinstance(x, str):
+                _xs[start:end] = self._code_points(x)
+            elif isinstance(x, array):
+                _xs[start:end] = array('i', x)
+            else:
+                _xs[start:end] = array('i', (ids.setdefault(t, len(ids)) for t in x))
+            _xs[end] = -(n + 1)
         self._build(_xs)
-        self.root._traverse(self._label_generalized)
+        self._traverse(self._label_generalized)
+
+    def add_text(self, x):
+        """Adds a string to a GST in place and returns its index, in time
+        proportional to its length plus the nodes whose mask changes, rather
+        than building the tree again over every string.
+
+        The string and its terminal are appended to the buffer, and the
+        McCreight construction carries on from there: the previous terminal
+        is unique, so the tree built so far is exactly the tree of the
+        buffer up to it. New leaves then set their string's bit on their
+        ancestors, stopping at the first which already has it.
+        """
+        if self.texts is None:
+            raise ValueError("Strings can only be added to a Generalized Suffix Tree.")
+        n = len(self.texts)
+        start = len(self.word)
+        self.texts.append(x)
+        self.word_starts.append(start)
+        if isinstance(x, str):
+            self.word.extend(self._code_points(x))
+        elif isinstance(x, array):
+            self.word.extend(array('i', x))
+        else:
+            self.word.extend(self._ids.setdefault(t, len(self._ids)) for t in x)
+        self.word.append(-(n + 1))
+        self._leaves_indexed = False
+        nodes = len(self.idx)
+        self._build_McCreight(self.word, start)
+
+        bit = 1 << n
+        masks = self.generalized_masks
+        for node in range(nodes, len(self.idx)): # Split from new leaves, which are labelled below
+            masks[node] &= ~bit
+        for i in range(start, len(self.word)):
+            node = self.parent[self._leaves[i]]
+            while not masks[node] & bit:
+                masks[node] |= bit
+                node = self.parent[node] # The root is its own parent, so this ends there
+        return n
+
+    def remove_text(self, n):
+        """Takes string n out of a GST in place, and returns the nodes which
+        lost it from their mask. Those merged or unlinked are out of the tree
+        and have parent -1.
+
+        The string's leaves are unlinked, its bit is cleared on their
+        ancestors, and nodes left with one child are merged into it (nodes
+        left without children are unlinked too). Suffix links stay valid, as
+        a node can only lose its branching if every node linking to it does.
+        Other nodes may still have labels inside the string, so it is kept
+        in the buffer and in texts, and indexes of other strings don't change.
+        """
+        start = self.word_starts[n]
+        end = start + len(self.texts[n]) + 1
+        bit = 1 << n
+        masks = self.generalized_masks
+        changed = []
+        for i in range(start, end):
+            node = self.parent[self._leaves[i]]
+            while masks[node] & bit:
+                masks[node] &= ~bit
+                changed.append(node)
+                node = self.parent[node]
+        self._leaves_indexed = False
+
+        for i in range(start, end):
+            leaf = self._leaves[i]
+            node = self.parent[leaf]
+            self._remove_transition_link(node, leaf)
+            self.parent[leaf] = -1
+            while node != self.root and self.parent[node] != -1:
+                children = list(self._get_children(node))
+                if len(children) > 1:
+                    break
+                parent = self.parent[node]
+                if children:
+                    self._replace_transition_link(parent, node, children[0])
+                    self.parent[children[0]] = parent
+                else:
+                    self._remove_transition_link(parent, node)
+                self.parent[node] = -1
+                node = parent
+        return changed
+
+    def _code_points(self, x):
+        """Returns the code points of string x as an array('i')."""
+        codes = array('i')
+        codes.frombytes(x.encode('utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'))
+        return codes
 
     def _label_generalized(self, node):
-        """Helper method that labels the nodes of GST with indexes of strings
-        found in their descendants.
+        """Helper method that labels the internal nodes of GST with a bitmask
+        of the strings found in their descendants: bit n is set if string n
+        is. Leaves keep 0 and get their single bit from generalized_mask.
         """
-        if node.is_leaf():
-            x = {self._get_word_start_index(node.idx)}
-        else:
-            x = {n for ns in node.transition_links for n in ns[0].generalized_idxs}
-        node.generalized_idxs = x
+        if self.is_leaf(node):
+            return
+        mask = 0
+        for c in self._get_children(node):
+            mask |= self.generalized_mask(c)
+        self.generalized_masks[node] = mask
+
+    def generalized_mask(self, node):
+        """Returns the bitmask of the strings containing the node's substring."""
+        if self.is_leaf(node):
+            return 1 << self._get_word_start_index(self.idx[node])
+        return self.generalized_masks[node]
+
+    def generalized_idxs(self, node):
+        """Returns the indexes of the strings containing the node's substring,
+        as a set-like DocumentSet."""
+        return DocumentSet(self.generalized_mask(node))
+
+    def generalized_count(self, node):
+        """Returns the number of strings containing the node's substring."""
+        return len(self.generalized_idxs(node))
 
     def _get_word_start_index(self, idx):
         """Helper method that returns the index of the string based on node's
         starting index"""
-        i = 0
-        for _idx in self.word_starts[1:]:
-            if idx < _idx:
-                return i
-            else:
-                i+=1
-        return i
+        return bisect_right(self.word_starts, idx) - 1
+
+    def _decode(self, start, end):
+        """Returns the input symbols between start and end, taken from the
+        original text for a GST. The range must not cross a terminal."""
+        if self.texts is None:
+            return self.word[start:end]
+        n = self._get_word_start_index(start)
+        offset = start - self.word_starts[n]
+        return self.texts[n][offset:offset + end - start]
 
     def lcs(self, stringIdxs=-1):
         """Returns the Largest Common Substring of Strings provided in stringIdxs.
@@ -161,25 +363,24 @@ class STree():
         ::param stringIdxs: Optional: List of indexes of strings.
         """
         if stringIdxs == -1 or not isinstance(stringIdxs, list):
-            stringIdxs = set(range(len(self.word_starts)))
+            stringIdxs = DocumentSet(self.generalized_masks[self.root]) # Not those removed
         else:
-            stringIdxs = set(stringIdxs)
+            stringIdxs = DocumentSet.of(stringIdxs)
 
         deepestNode = self._find_lcs(self.root, stringIdxs)
-        start = deepestNode.idx
-        end = deepestNode.idx + deepestNode.depth
-        return ''.join(self.word[start:end])
+        start = self.idx[deepestNode]
+        end = self.idx[deepestNode] + self.depth[deepestNode]
+        label = self._decode(start, end)
+        return label if isinstance(label, (str, array)) else ''.join(label)
 
     def _find_lcs(self, node, stringIdxs):
         """Helper method that finds LCS by traversing the labeled GSD."""
-        nodes = [self._find_lcs(n, stringIdxs)
-            for (n,_) in node.transition_links
-            if n.generalized_idxs.issuperset(stringIdxs)]
-
-        if nodes == []:
-            return node
-    
-        deepestNode = max(nodes, key=lambda n: n.depth)
+        want = stringIdxs.mask
+        keep = lambda n: self.generalized_mask(n) & want == want
+        deepestNode = node
+        for n in self._preorder(node, keep):
+            if self.depth[n] > self.depth[deepestNode]:
+                deepestNode = n
         return deepestNode
 
     def _generalized_word_starts(self, xs):
@@ -200,9 +401,9 @@ class STree():
         """
         node = self.root
         while True:
-            edge = self._edgeLabel(node, node.parent)
+            edge = self._edgeLabel(node, self.parent[node])
             if edge.startswith(y):
-                return node.idx
+                return self.idx[node]
             
             i = 0
             while(i < len(edge) and edge[i] == y[0]):
@@ -215,15 +416,15 @@ class STree():
                 else:
                     return -1
             
-            node = node._get_transition_link(y[0])
-            if not node:
+            node = self._get_transition_link(node, y[0])
+            if node == -1:
                 return -1
 
     def find_all(self, y):
         y_input = y
         node = self.root
         while True:
-            edge = self._edgeLabel(node, node.parent)
+            edge = self._edgeLabel(node, self.parent[node])
             if edge.startswith(y):
                 break
 
@@ -238,16 +439,15 @@ class STree():
                 else:
                     return []
 
-            node = node._get_transition_link(y[0])
-            if not node:
+            node = self._get_transition_link(node, y[0])
+            if node == -1:
                 return []
 
-        leaves = node._get_leaves()
-        return [n.idx for n in leaves]
+        return [self.idx[n] for n in self._get_leaves(node)]
 
     def _edgeLabel(self, node, parent):
         """Helper method, returns the edge label between a node and it's parent"""
-        return self.word[node.idx + parent.depth : node.idx + node.depth]
+        return self.word[self.idx[node] + self.depth[parent] : self.idx[node] + self.depth[node]]
 
 
     def _terminalSymbolsGenerator(self):
@@ -255,69 +455,165 @@ class STree():
         Unicode Private Use Area U+E000..U+F8FF is used to ensure that terminal symbols
         are not part of the input string.
         """
-        py2 = sys.version[0] < '3'
-        UPPAs = list(list(range(0xE000,0xF8FF+1)) + list(range(0xF0000,0xFFFFD+1)) + list(range(0x100000, 0x10FFFD+1)))
-        for i in UPPAs:
-            if py2:
-                yield(unichr(i))
-            else:
+        UPPAs = (range(0xE000,0xF8FF+1), range(0xF0000,0xFFFFD+1), range(0x100000, 0x10FFFD+1))
+        for block in UPPAs:
+            for i in block:
                 yield(chr(i))
         raise ValueError("To many input strings.")
 
-
-class _SNode():
-    """Class representing a Node in the Suffix tree."""
-    def __init__(self, idx=-1, parentNode=None, depth=-1):
-        # Links
-        self._suffix_link = None
-        self.transition_links = []
-        # Properties
-        self.idx = idx
-        self.depth = depth
-        self.parent = parentNode
-        self.generalized_idxs = {}
-
-    def __str__(self):
-        return("SNode: idx:"+ str(self.idx) + " depth:"+str(self.depth) +
-            " transitons:" + str(self.transition_links))
-
-    def _add_suffix_link(self, snode):
-        self._suffix_link = snode
-
-    def _get_suffix_link(self):
-        if self._suffix_link != None:
-            return self._suffix_link
-        else:
-            return False
-
-    def _get_transition_link(self, suffix):
-        for node,_suffix in self.transition_links:
-            if _suffix == '__@__' or suffix == _suffix:
-                return node
-        return False
-
-    def _add_transition_link(self, snode, suffix=''):
-        tl = self._get_transition_link(suffix)
-        if tl: # TODO: imporve this.
-            self.transition_links.remove((tl,suffix))
-        self.transition_links.append((snode,suffix))
-
-    def _has_transition(self, suffix):
-        for node,_suffix in self.transition_links:
-            if _suffix == '__@__' or suffix == _suffix:
-                return True
-        return False
-
-    def is_leaf(self):
-        return self.transition_links == []
-
-    def _traverse(self, f):
-        for (node,_) in self.transition_links:
-            node._traverse(f)
-        f(self)
-
-    def _get_leaves(self):
-        if self.is_leaf():
-            return [self]
+    # Node accessors. A node is an int id; -1 stands for "no node".
+
+    def _add_suffix_link(self, node, snode):
+        self._suffix_link[node] = snode
+
+    def _get_suffix_link(self, node):
+        return self._suffix_link[node]
+
+    def _get_transition_link(self, node, suffix):
+        """Returns the child of node whose edge starts with suffix, or -1."""
+        child = self._first_child[node]
+        if child == -2:
+            return self._child_index[node].get(suffix, -1)
+        word = self.word
+        idx = self.idx
+        d = self.depth[node]
+        while child != -1:
+            if word[idx[child] + d] == suffix:
+                return child
+            child = self._next_sibling[child]
+        return -1
+
+    def _edge_symbol(self, node, child):
+        """Returns the first symbol on the edge from node to child."""
+        return self.word[self.idx[child] + self.depth[node]]
+
+    def _add_transition_link(self, node, snode):
+        """Appends snode to the children of node."""
+        child = self._first_child[node]
+        if child == -2:
+            self._child_index[node][self._edge_symbol(node, snode)] = snode
+            return
+        if child == -1:
+            self._first_child[node] = snode
+            return
+        fanout = 1
+        while self._next_sibling[child] != -1:
+            child = self._next_sibling[child]
+            fanout += 1
+        self._next_sibling[child] = snode
+        if fanout >= _INDEX_FANOUT:
+            self._index_children(node)
+
+    def _index_children(self, node):
+        """Moves the children of node from the sibling list into a dict."""
+        index = {}
+        child = self._first_child[node]
+        while child != -1:
+            index[self._edge_symbol(node, child)] = child
+            next_child = self._next_sibling[child]
+            self._next_sibling[child] = -1
+            child = next_child
+        self._child_index[node] = index
+        self._first_child[node] = -2
+
+    def _replace_transition_link(self, node, old, new):
+        """Removes old from the children of node and appends new, which keeps
+        children in the order the original transition list had."""
+        self._remove_transition_link(node, old)
+        self._add_transition_link(node, new)
+
+    def _remove_transition_link(self, node, old):
+        """Removes old from the children of node."""
+        child = self._first_child[node]
+        if child == -2:
+            del self._child_index[node][self._edge_symbol(node, old)]
+            return
+        if child == old:
+            self._first_child[node] = self._next_sibling[old]
         else:
-            return [x for (n,_) in self.transition_links for x in n._get_leaves()]
+            while self._next_sibling[child] != old:
+                child = self._next_sibling[child]
+            self._next_sibling[child] = self._next_sibling[old]
+        self._next_sibling[old] = -1
+
+    def _get_children(self, node):
+        child = self._first_child[node]
+        if child == -2:
+            yield from self._child_index[node].values()
+            return
+        while child != -1:
+            yield child
+            child = self._next_sibling[child]
+
+    def is_leaf(self, node):
+        return self._first_child[node] == -1
+
+    def _traverse(self, f, node=None):
+        for n in self._postorder(node):
+            f(n)
+
+    def _preorder(self, node=None, keep=None):
+        """Yields node and its descendants in depth-first pre-order. Uses an
+        explicit stack of child iterators, so memory grows with the depth of
+        the tree rather than the recursion limit. Children for which keep
+        returns False are skipped together with their subtrees."""
+        if node is None:
+            node = self.root
+        yield node
+        stack = [self._get_children(node)]
+        while stack:
+            child = next(stack[-1], -1)
+            if child == -1:
+                stack.pop()
+            elif keep is None or keep(child):
+                yield child
+                if not self.is_leaf(child):
+                    stack.append(self._get_children(child))
+
+    def _postorder(self, node=None):
+        """Yields node and its descendants in depth-first post-order, with an
+        explicit stack like _preorder."""
+        if node is None:
+            node = self.root
+        stack = [(node, self._get_children(node))]
+        while stack:
+            n, children = stack[-1]
+            child = next(children, -1)
+            if child == -1:
+                stack.pop()
+                yield n
+            elif self.is_leaf(child):
+                yield child
+            else:
+                stack.append((child, self._get_children(child)))
+
+    def _get_leaves(self, node):
+        if not self._leaves_indexed: # Changed since it was built
+            return [n for n in self._preorder(node) if self.is_leaf(n)]
+        start = self._leaf_start[node]
+        return list(self._leaf_order[start:start + self.leaf_count[node]])
+
+    def _index_leaves(self):
+        """Numbers the leaves in depth-first order and records, for every node,
+        its number of leaves and the position of its first leaf, in a single
+        pass with an explicit stack."""
+        n = len(self.idx)
+        self.leaf_count = array(self.idx.typecode, [0]) * n
+        self._leaf_start = array(self.idx.typecode, [0]) * n
+        self._leaf_order = array(self.idx.typecode)
+        order = self._leaf_order
+        stack = [(self.root, self._get_children(self.root))]
+        while stack:
+            node, children = stack[-1]
+            child = next(children, -1)
+            if child == -1:
+                stack.pop()
+                self.leaf_count[node] = len(order) - self._leaf_start[node]
+                continue
+            self._leaf_start[child] = len(order)
+            if self.is_leaf(child):
+                self.leaf_count[child] = 1
+                order.append(child)
+            else:
+                stack.append((child, self._get_children(child)))
+        self._leaves_indexed = True
@@ -0,0 +1,107 @@
+from array import array
+from bisect import bisect_left
+from heapq import heappush, heapreplace
+from pathlib import Path
+import os
+import pickle
+import tempfile
+
+class RepeatIndex():
+    '''Every repeat found in one text, with its occurrences and length, so results at any thresholds
+can be read off without analysing the text again.
+
+The repeats are kept in result order (by occurrences, then characters, then alphabetically) as a list
+of substrings and parallel arrays of occurrences, lengths and termhood scores. query finds the first repeat with
+enough occurrences by binary search, and only filters the rest by length.'''
+
+    VERSION = 3 # Change when analysis changes, so saved indexes are rebuilt
+
+    def __init__(self, repeats=(), cut=None):
+        '''repeats: (substring, occurrences, length, termhood) tuples in any order.
+cut: the (top_k, score, min_length, min_occurrences) the repeats were cut down to as they were found, if
+they are not every repeat of the text, so the index only gives the right results at those settings.'''
+        repeats = sorted(repeats, key=lambda r: (r[1], len(r[0]), r[0]))
+        self.substrings = [r[0] for r in repeats]
+        self.occurrences = array('i', (r[1] for r in repeats))
+        self.lengths = array('i', (r[2] for r in repeats))
+        self.termhood = array('d', (r[3] for r in repeats))
+        self.cut = cut
+        self.by_length = None # Positions from the longest repeat down, made by top when first needed
+
+    def __len__(self):
+        return len(self.substrings)
+
+    def query(self, min_length, min_occurrences):
+        '''Returns the (substring, occurrences, termhood) results at the given thresholds, in result order.'''
+        start = bisect_left(self.occurrences, min_occurrences)
+        lengths = self.lengths
+        return [(self.substrings[i], self.occurrences[i], self.termhood[i]) for i in range(start, len(self)) if lengths[i] >= min_length]
+
+    def top(self, k, min_length, min_occurrences, score, by='occurrences'):
+        '''Returns the k results with the highest score at the given thresholds, lowest first like query, with ties
+in result order. score is either a function score(occurrences, length), which must never fall as occurrences
+or length grow, or a score for every repeat in the index, such as termhood.
+
+The repeats are walked from the most occurrences down, or with by='length' from the longest down, keeping the
+best k in a heap. With a function, the walk stops as soon as the rest can't beat the worst of them even at the
+longest length or the most occurrences in the index. Memory and sorting scale with k, and for scores led by
+whichever the walk is ordered by, only a little more than k repeats are looked at.'''
+        if k <= 0:
+            return []
+        start = bisect_left(self.occurrences, min_occurrences)
+        occurrences = self.occurrences
+        lengths = self.lengths
+        bound = callable(score)
+        heap = [] # (score, position), so ties go to the later position in result order
+        if by == 'length':
+            if self.by_length is None:
+                self.by_length = array('i', sorted(range(len(self)), key=lambda i: (lengths[i], i), reverse=True))
+            most = occurrences[-1] if len(self) else 0
+            order = self.by_length
+            beaten = lambda i: score(most, lengths[i]) < heap[0][0] # Equal scores can still come later in result order
+        else:
+            longest = max(lengths, default=0)
+            order = range(len(self) - 1, start - 1, -1)
+            beaten = lambda i: score(occurrences[i], longest) <= heap[0][0]
+        for i in order:
+            if bound and len(heap) == k and beaten(i):
+                break
+            if occurrences[i] < min_occurrences or lengths[i] < min_length:
+                continue
+            item = (score(occurrences[i], lengths[i]) if bound else score[i], i)
+            if len(heap) < k:
+                heappush(heap, item)
+            elif item > heap[0]:
+                heapreplace(heap, item)
+        return [(self.substrings[i], occurrences[i], self.termhood[i]) for s, i in sorted(heap)]
+
+    def save(self, path):
+        '''Writes the index to path through a temporary file, so readers never see part of it.'''
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((self.VERSION, self.substrings, self.occurrences, self.lengths, self.termhood), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        '''Returns the index saved at path, or None if there isn't a current one.'''
+        try:
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        if saved[0] != cls.VERSION:
+            return None
+        version, substrings, occurrences, lengths, termhood = saved
+        index = cls()
+        index.substrings = substrings
+        index.occurrences = occurrences
+        index.lengths = lengths
+        index.termhood = termhood
+        return index
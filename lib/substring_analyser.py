@@ -1,193 +1,1160 @@
 from lib.ptrus_suffix_trees.STree import STree
+from lib.suffix_array import SuffixArray, ShardedSuffixArray
+from lib.vocabulary import Vocabulary, tokenize, tokenize_blocks
+from lib.document_set import DocumentSet
+from lib.exporters import EXPORTERS
+from lib.repeat_index import RepeatIndex
+from lib.instrumentation import Stage, print_loading
+from heapq import heappush, heapreplace
+from bisect import bisect_left
 import xlsxwriter
 import re
-from threading import Thread, Event
+from array import array
+from itertools import accumulate, chain
+from math import log2
+from collections import Counter
+import os
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+MODES = ('all', 'maximal', 'supermaximal')
+'''Which repeats are kept in the results:
+all: every repeat which is not always followed by the same symbol.
+maximal: repeats which are also not always preceded by the same symbol, so no longer repeat has the same occurrences.
+supermaximal: maximal repeats which don't occur inside any other repeat.
+Common substrings contained in a longer common substring are skipped in both maximal and supermaximal modes.'''
+
+SCORES = {'occurrences' : lambda occurrences, length: occurrences,
+          'length' : lambda occurrences, length: length,
+          'occurrences_length' : lambda occurrences, length: occurrences * length,
+          'termhood' : None}
+'''Scores which top_k ranks repeats by, from their occurrences and length, or None for the termhood
+score of each repeat, kept in its RepeatIndex.'''
+
+TERMHOOD = ('cvalue', 'ncvalue')
+'''The termhood score given to every repeat:
+cvalue: the C-value of Frantzi, Ananiadou and Mima (2000), with the length counted one more so that
+single words still score. The repeats nested in each one are the longer repeats of the mode it occurs
+in anywhere, found by nesting once every repeat is known.
+ncvalue: the NC-value, which adds weight for the symbols following a repeat which often follow others.'''
+
+def c_value(occurrences, length, nested, nested_occurrences):
+    '''Returns the C-value of a repeat, from the number of longer repeats it is nested in and the sum of
+their occurrences, which are taken away from its own on average.'''
+    if nested:
+        occurrences = occurrences - nested_occurrences / nested
+    return log2(length + 1) * occurrences
+
+def nesting(ranks, idxs, depths, occurrences, lbs, found):
+    '''Takes every internal node of the tree of a text, bottom-up, as arrays of the idx, depth, occurrences and
+rank (the first of the suffixes it starts, in ranks, the rank of the suffix at each position) of each, and
+whether it is a repeat of the mode. Returns arrays of (nested, nested_occurrences) for each node: how many
+of the repeats of the mode it occurs in, other than itself, and the sum of their occurrences.
+
+The nodes a repeat b occurs in are those on the paths from the root to b and to each of its suffixes,
+which are the nodes its suffix links lead to. Those on the path to b which aren't on the paths of b[1:]
+run from b up to h(b), the deepest ancestor of b which is part of b[1:], so b is counted from b up to h(b)
+and again for each of the nodes whose suffix links lead to b, which is done once for all of them by taking
+sums down the tree of suffix links. h(b) is found by walking up from the parent of b, checking whether any
+node on the path of suffix links from b[1:] is below each node on the way.'''
+    n = len(idxs)
+    # Suffix links and parents, from a sweep down the ranks with the ancestors of the current rank on a stack,
+    # which meets the nodes in reverse order, and the suffix link of each node by the rank of its second symbol
+    parents = array('i', [-1]) * n
+    links = array('i', [-1]) * n # -1 for the root
+    counts = array('i', bytes(4 * (len(ranks) + 1)))
+    for i in range(n):
+        if depths[i] > 1:
+            counts[ranks[idxs[i] + 1] + 1] += 1
+    starts = array('i', accumulate(counts))
+    queries = array('i', bytes(4 * starts[-1])) # Nodes by the rank of their second symbol
+    for i in range(n):
+        if depths[i] > 1:
+            r = ranks[idxs[i] + 1]
+            queries[starts[r]] = i
+            starts[r] += 1
+    del counts, starts
+    stack = []
+    stack_depths = []
+    k = len(queries) - 1
+    for i in range(n - 1, -2, -1):
+        end = lbs[i] + occurrences[i] if i >= 0 else -1 # -1 answers the rest
+        while k >= 0 and ranks[idxs[queries[k]] + 1] >= end:
+            q = queries[k]
+            r = ranks[idxs[q] + 1]
+            while stack and lbs[stack[-1]] > r:
+                stack.pop()
+                stack_depths.pop()
+            links[q] = stack[bisect_left(stack_depths, depths[q] - 1)]
+            k = k - 1
+        if i < 0:
+            break
+        while stack and lbs[stack[-1]] >= end:
+            stack.pop()
+            stack_depths.pop()
+        parents[i] = stack[-1] if stack else -1
+        stack.append(i)
+        stack_depths.append(depths[i])
+    del queries, stack, stack_depths
+    firsts = array('i', range(n)) # The descendants of a node come just before it, from firsts onwards
+    for i in range(n):
+        if parents[i] != -1:
+            firsts[parents[i]] = min(firsts[parents[i]], firsts[i])
+
+    # Depth-first over the tree of suffix links, with the nodes on the path to the current one counted in a
+    # Fenwick tree, by their order bottom-up, as the path is as long as the longest repeat
+    heads = array('i', [-1]) * n
+    siblings = array('i', [-1]) * n
+    tops = []
+    for i in range(n):
+        if links[i] == -1:
+            tops.append(i)
+        else:
+            siblings[i] = heads[links[i]]
+            heads[links[i]] = i
+    nested = array('q', list(found))
+    nested_occurrences = array('q', (o if f else 0 for o, f in zip(occurrences, found)))
+    ends = array('i', [-1]) * n # h of each node, -1 for the root
+    path = array('i', bytes(4 * (n + 1)))
+    def mark(i, change):
+        i = i + 1
+        while i <= n:
+            path[i] += change
+            i += i & -i
+    def marked(first, last): # How many of the nodes from first to last are on the path
+        total = 0
+        last = last + 1
+        while last > first:
+            total += path[last]
+            last &= last - 1
+        while first > last:
+            total -= path[first]
+            first &= first - 1
+        return total
+
+    stack = tops
+    while stack:
+        i = stack.pop()
+        if i < 0: # Leaving the node, so its sums go to its suffix link
+            i = ~i
+            if heads[i] != -1:
+                mark(i, -1)
+            if links[i] != -1:
+                nested[links[i]] += nested[i]
+                nested_occurrences[links[i]] += nested_occurrences[i]
+            continue
+        # h(b)[1:] is part of b[2:], so h(b) is at most one deeper than h(b[1:])
+        h = ends[links[i]] if links[i] != -1 else -1
+        limit = (depths[h] if h != -1 else 0) + 1
+        v = parents[i]
+        while v != -1 and depths[v] > limit:
+            v = parents[v]
+        while v != -1:
+            if marked(firsts[v], v):
+                break
+            v = parents[v]
+        ends[i] = v
+        stack.append(~i)
+        if heads[i] != -1: # Only on the path of the nodes whose suffix links lead to it
+            mark(i, 1)
+        child = heads[i]
+        while child != -1:
+            stack.append(child)
+            child = siblings[child]
+    del heads, siblings, path, links
+
+    # Counted from each node up to its h, by sums up the tree
+    counted = array('q', nested)
+    counted_occurrences = array('q', nested_occurrences)
+    for i in range(n):
+        if ends[i] != -1:
+            counted[ends[i]] -= nested[i]
+            counted_occurrences[ends[i]] -= nested_occurrences[i]
+    for i in range(n):
+        if parents[i] != -1:
+            counted[parents[i]] += counted[i]
+            counted_occurrences[parents[i]] += counted_occurrences[i]
+        if found[i]: # Each counted itself
+            counted[i] -= 1
+            counted_occurrences[i] -= occurrences[i]
+    return counted, counted_occurrences
+
+def nc_values(cvalues, contexts):
+    '''Returns the NC-values of repeats from their C-values and contexts, lists of (symbol, occurrences)
+of the symbols which follow them. Each symbol is weighted by the share of the repeats it follows.'''
+    weights = Counter(symbol for context in contexts for symbol, o in context)
+    n = len(contexts)
+    return [0.8 * c + 0.2 * sum(o * weights[symbol] for symbol, o in context) / n
+            for c, context in zip(cvalues, contexts)]
+
+_DIVERSE = object() # Marks substrings preceded by more than one symbol
+
+def _extends_left(occurrences):
+    '''Takes (preceding symbol, text bitmask) for each occurrence of a common substring, and returns True
+if the same symbol precedes it in more than one text, so it is part of a longer common substring.'''
+    masks = {}
+    for symbol, leaf in occurrences:
+        mask = masks.get(symbol, 0) | leaf
+        if mask & (mask - 1):
+            return True
+        masks[symbol] = mask
+    return False
+
+class STreeEngine():
+    '''Finds repeats and common substrings by traversing an explicit suffix tree.
+Engines are built over one text, or over a list of texts with gst=True, and expose two
+generators of tuples starting (idx, depth, value), where label(idx, depth) is the substring.'''
+
+    def __init__(self, text, gst=False):
+        self.tree = STree(text, gst=gst)
+
+    def nodes(self):
+        '''Returns the number of nodes of the tree, including any removed from it.'''
+        return len(self.tree.idx)
+
+    def label(self, idx, depth):
+        '''Returns the substring of length depth at idx, as a slice of the input text.'''
+        return self.tree._decode(idx, idx + depth)
+
+    def repeats(self, mode='all', context=False):
+        '''Yields (idx, depth, occurrences, rank, found, following) for every repeated substring which is not
+always followed by the same symbol (every internal node of the tree), bottom-up, where found tells whether
+it is a repeat of the mode. See MODES for the maximal and supermaximal modes. The suffixes starting the
+repeat are those from rank onwards in ranks. With context, following is a list of (position, occurrences)
+of the symbols which can follow a repeat of the mode, one for each child, where position may be the end of
+the text. Otherwise it is None.'''
+        st = self.tree
+        word = st.word
+        before = {} # Symbol preceding every occurrence of a visited node, or _DIVERSE
+        self.suffix_ranks = array('i', bytes(4 * len(word))) # Filled in as leaves are visited, for ranks
+        leaves = 0 # Leaves visited so far, in the order of ranks
+        for node in st._postorder():
+            if st.is_leaf(node): # Leaves never repeat
+                self.suffix_ranks[st.idx[node]] = leaves
+                leaves += 1
+                if mode != 'all':
+                    before[node] = word[st.idx[node] - 1] # The first suffix wraps round to the unique terminal
+                continue
+            children = list(st._get_children(node))
+            if mode == 'all':
+                found = node != st.root
+            else:
+                symbols = [before.pop(c) for c in children]
+                symbol = symbols[0] if symbols.count(symbols[0]) == len(symbols) else _DIVERSE
+                before[node] = symbol
+                if node == st.root:
+                    found = False
+                elif mode == 'maximal':
+                    found = symbol is _DIVERSE
+                else:
+                    found = all(st.is_leaf(c) for c in children) and len(set(symbols)) == len(symbols)
+            if node != st.root:
+                depth = st.depth[node]
+                following = [(st.idx[c] + depth, st.leaf_count[c]) for c in children] if context and found else None
+                yield (st.idx[node], depth, st.leaf_count[node], leaves - st.leaf_count[node], found, following)
+
+    def ranks(self):
+        '''Returns the rank of the suffix at every position of the text, the order repeats visits its leaf in,
+which is recorded as it does. Only valid once repeats has visited every node.'''
+        return self.suffix_ranks
+
+    def common(self, mode='all'):
+        '''Yields (idx, depth, idxs) for the deepest substrings shared by more than one
+text, where idxs is the DocumentSet of texts containing the substring. Unless mode is
+'all', substrings which are part of a longer common substring are skipped.'''
+        gst = self.tree
+        for node in gst._preorder(keep=self.shared):
+            if self.is_common(node, mode):
+                yield (gst.idx[node], gst.depth[node], gst.generalized_idxs(node))
+
+    def shared(self, node):
+        return self.tree.generalized_count(node) > 1
+
+    def is_common(self, node, mode='all'):
+        '''Returns True if common yields node: the root or a node shared by more than one text,
+none of whose children are.'''
+        gst = self.tree
+        if node != gst.root and not self.shared(node):
+            return False
+        if any(self.shared(n) for n in gst._get_children(node)):
+            return False
+        return mode == 'all' or node == gst.root or not _extends_left(
+            (gst.word[gst.idx[leaf] - 1], gst.generalized_mask(leaf)) for leaf in gst._get_leaves(node))
+
+class CommonIndex():
+    '''The common substrings of a set of texts which changes one text at a time, kept up to date
+without building the generalised suffix tree again.
+
+Texts are added to and removed from the tree in place, and only the nodes whose texts changed
+(the ancestors of the added or removed leaves) are checked again, as no other node can start or
+stop being common. Texts are numbered in the order they were added, and removed texts keep their
+numbers, so DocumentSets from common have gaps where texts were removed.'''
+
+    def __init__(self, texts=(), mode='all'):
+        '''texts: the first texts, which are built into the tree in one go, and numbered from 0.'''
+        self.engine = STreeEngine(list(texts), gst=True)
+        self.mode = mode
+        st = self.engine.tree
+        self.nodes = set(n for n in st._preorder(keep=self.engine.shared) if self.engine.is_common(n, mode)) # Nodes common yields
+
+    def add(self, text):
+        '''Adds a text and returns its number.'''
+        st = self.engine.tree
+        n = st.add_text(text)
+        start = st.word_starts[n]
+        changed = set()
+        for i in range(start, start + len(text) + 1):
+            node = st.parent[st._leaves[i]]
+            while node not in changed:
+                changed.add(node)
+                node = st.parent[node] # Ends at the root, its own parent
+        self.update(changed)
+        return n
+
+    def remove(self, n):
+        '''Removes text number n.'''
+        self.update(self.engine.tree.remove_text(n))
+
+    def update(self, nodes):
+        '''Checks whether each of nodes is common, after their texts changed.'''
+        st = self.engine.tree
+        for node in nodes:
+            if node != st.root and st.parent[node] == -1: # Taken out of the tree
+                self.nodes.discard(node)
+            elif self.engine.is_common(node, self.mode):
+                self.nodes.add(node)
+            else:
+                self.nodes.discard(node)
+
+    def label(self, idx, depth):
+        return self.engine.label(idx, depth)
+
+    def common(self):
+        '''Yields (idx, depth, idxs) for the current common substrings, as STreeEngine.common does.'''
+        st = self.engine.tree
+        for node in self.nodes:
+            yield (st.idx[node], st.depth[node], st.generalized_idxs(node))
+
+class SuffixArrayEngine():
+    '''Finds the same repeats and common substrings as STreeEngine from a suffix array and
+LCP array, by enumerating LCP intervals bottom-up (Abouelhoda et al., 2004). Every
+LCP interval is an internal node of the suffix tree, so the tree is never built.'''
+
+    max_depth = None # Deepest repeat yielded, for ShardedEngine
+
+    def __init__(self, text, gst=False):
+        self.index = SuffixArray(text, gst=gst)
+
+    def nodes(self):
+        '''Returns the number of suffixes, the leaves of the suffix tree this stands in for.'''
+        return len(self.index)
+
+    def label(self, idx, depth):
+        '''Returns the substring of length depth at idx, as a slice of the input text.'''
+        return self.index.label(idx, depth)
+
+    def repeats(self, mode='all', context=False):
+        '''Yields (idx, depth, occurrences, rank, found, following) for every LCP interval with a non-zero LCP,
+bottom-up, as STreeEngine.repeats does, where rank is the interval's left bound. See MODES for the
+maximal and supermaximal modes, which track the symbols preceding each interval. The suffixes are read
+in one pass, as (position, lcp) from the index's suffixes, and the child intervals (including single
+suffixes) are kept as (left bound, position) for following and supermaximal, at the places where the
+LCP equals the interval's.'''
+        suffixes = iter(self.index.suffixes())
+        first = next(suffixes, None)
+        if first is None:
+            return
+        previous = first[0] # Position of the suffix before
+        max_depth = self.max_depth
+        track = mode != 'all'
+        preceding = self.index.preceding
+        # [lcp, left bound, position at the left bound, preceding symbol or _DIVERSE, has a child interval, child bounds]
+        stack = [[0, 0, previous, _DIVERSE, True, []]]
+        for i, (p, h) in enumerate(chain(suffixes, [(None, 0)]), 1): # The end closes every interval
+            symbol = preceding(previous) if track else None
+            if h > stack[-1][0]:
+                stack.append([h, i - 1, previous, symbol, False, [(i - 1, previous), (i, p)]])
+                previous = p
+                continue
+            if stack[-1][3] != symbol:
+                stack[-1][3] = _DIVERSE
+            if h == stack[-1][0]:
+                stack[-1][5].append((i, p))
+            while h < stack[-1][0]:
+                depth, lb, start, symbol, inner, bounds = stack.pop()
+                if mode == 'all':
+                    found = True
+                elif mode == 'maximal':
+                    found = symbol is _DIVERSE
+                else: # With no child intervals, every suffix is a child
+                    found = not inner and len(set(preceding(q) for b, q in bounds)) == i - lb
+                if max_depth is None or depth <= max_depth:
+                    following = None
+                    if found and context:
+                        ends = [b for b, q in bounds[1:]] + [i]
+                        following = [(q + depth, e - b) for (b, q), e in zip(bounds, ends)]
+                    yield (start, depth, i - lb, lb, found, following)
+                if h > stack[-1][0]:
+                    stack.append([h, lb, start, symbol, True, [(lb, start), (i, p)]])
+                else:
+                    parent = stack[-1]
+                    if parent[3] != symbol:
+                        parent[3] = _DIVERSE
+                    parent[4] = True
+                    if h == parent[0]:
+                        parent[5].append((i, p))
+            previous = p
+
+    def ranks(self):
+        '''Returns the rank of the suffix at every position of the text, the inverse of the suffix array.'''
+        sa = self.index.sa
+        ranks = array('i', bytes(4 * len(sa)))
+        for rank, p in enumerate(sa):
+            ranks[p] = rank
+        return ranks
+
+    def common(self, mode='all'):
+        '''Yields (idx, depth, idxs) for LCP intervals spanning more than one text none of
+whose child intervals do, plus the root if no interval qualifies. Unless mode is 'all',
+intervals which are part of a longer common substring are skipped.'''
+        sa = self.index.sa
+        lcp = self.index.lcp
+        doc = self.index.doc
+        preceding = self.index.preceding
+        n = len(sa)
+        stack = [[0, 0, 0, False]] # [lcp, left bound, bitmask of texts, has a common child]
+        for i in range(1, n + 1):
+            h = lcp[i] if i < n else -1 # -1 closes the root too
+            leaf = 1 << doc[sa[i - 1]]
+            if h > stack[-1][0]:
+                stack.append([h, i - 1, leaf, False])
+                continue
+            stack[-1][2] |= leaf
+            while stack and h < stack[-1][0]:
+                depth, lb, mask, common_child = stack.pop()
+                shared = mask & (mask - 1) != 0 # More than one bit set
+                if (shared or not stack) and not common_child:
+                    if mode == 'all' or not stack or not _extends_left(
+                            (preceding(sa[k]), 1 << doc[sa[k]]) for k in range(lb, i)):
+                        yield (sa[lb], depth, DocumentSet(mask))
+                if not stack:
+                    break
+                if h > stack[-1][0]:
+                    stack.append([h, lb, mask, shared])
+                else:
+                    stack[-1][2] |= mask
+                    stack[-1][3] = stack[-1][3] or shared
+
+class ShardedEngine(SuffixArrayEngine):
+    '''Finds the repeats of one text up to max_depth symbols long, as SuffixArrayEngine does, from a
+ShardedSuffixArray of shards of the text sorted by map, so no suffix array or LCP array of the whole text
+is built, only the rank of each suffix, which repeats fills in as it merges the shards.
+Repeats in more than one shard, or across the end of a shard, are counted like any other. The repeats
+nested in each one and the symbols following it are only those up to max_depth long too, so termhood
+scores can differ from those of the whole text for repeats with longer ones nested in them.
+
+With gst=True, text is a list of texts and bounds a list of the bounds of each, and common finds the
+common substrings of up to max_depth symbols, which are the same as those SuffixArrayEngine finds.'''
+
+    def __init__(self, text, bounds, max_depth, map=map, gst=False):
+        self.index = ShardedSuffixArray(text, bounds, max_depth + 1, map, gst) # One deeper, to tell which intervals end at max_depth
+        self.max_depth = max_depth
+
+    def ranks(self):
+        '''Returns the rank of the suffix at every position of the text, once repeats has been read.'''
+        return self.index.ranks
+
+    def common(self, mode='all'):
+        '''Yields (idx, depth, idxs) for the common substrings of up to max_depth symbols, as SuffixArrayEngine.common
+does, reading the merged shards in one pass. An interval deeper than max_depth stands for every node below it
+with the same first max_depth + 1 symbols, which are the suffixes of one node, so whether an interval has a
+common child is still exact. Unless mode is 'all', each interval keeps a dict of the texts each symbol
+precedes it in, which is merged into its parent's as it closes.'''
+        suffixes = iter(self.index.suffixes())
+        first = next(suffixes, None)
+        if first is None:
+            return
+        previous = first[0]
+        document = self.index.document
+        preceding = self.index.preceding
+        track = mode != 'all'
+        # [lcp, position at the left bound, bitmask of texts, has a common child, {preceding symbol : bitmask of texts}]
+        stack = [[0, previous, 0, False, {}]]
+        for p, h in chain(suffixes, [(None, -1)]): # -1 closes the root too
+            leaf = 1 << document(previous)
+            if h > stack[-1][0]:
+                stack.append([h, previous, leaf, False, {preceding(previous) : leaf} if track else None])
+                previous = p
+                continue
+            top = stack[-1]
+            top[2] |= leaf
+            if track:
+                symbol = preceding(previous)
+                top[4][symbol] = top[4].get(symbol, 0) | leaf
+            while stack and h < stack[-1][0]:
+                depth, start, mask, common_child, symbols = stack.pop()
+                shared = mask & (mask - 1) != 0 # More than one bit set
+                if (shared or not stack) and not common_child and depth <= self.max_depth:
+                    if mode == 'all' or not stack or not any(m & (m - 1) for m in symbols.values()):
+                        yield (start, depth, DocumentSet(mask))
+                if not stack:
+                    break
+                if h > stack[-1][0]:
+                    stack.append([h, start, mask, shared, symbols])
+                else:
+                    parent = stack[-1]
+                    parent[2] |= mask
+                    parent[3] = parent[3] or shared
+                    if track:
+                        if len(parent[4]) < len(symbols): # Merges the smaller dict into the larger
+                            parent[4], symbols = symbols, parent[4]
+                        for symbol, m in symbols.items():
+                            parent[4][symbol] = parent[4].get(symbol, 0) | m
+            previous = p
+
+SPACED_PUNCTUATION = '\'!"()*,./:;<>?[]{} \n\t'
+UNSPACED_PUNCTUATION = ' \n\t。、（）「」　？・'
+
+def prefix_sums(mask):
+    '''Returns the running totals of a mask of 0s and 1s, starting from 0, so the number of 1s between
+positions i and j is prefix[j] - prefix[i].'''
+    return array('i', accumulate(mask, initial=0))
+
+ENGINES = {'stree' : STreeEngine, 'suffix_array' : SuffixArrayEngine}
+POOLS = {'process' : ProcessPoolExecutor, 'thread' : ThreadPoolExecutor}
+EXCEL_ROWS = 1048576 # Rows per worksheet, including the header
+BREAKS = ('\n', '.!?。！？') # Where shards end by preference: after a paragraph, else after a sentence
+
+def last_break(symbols, marks):
+    '''Returns the position of the last symbol containing any of marks, or -1.'''
+    for i in range(len(symbols) - 1, -1, -1):
+        if any(m in symbols[i] for m in marks):
+            return i
+    return -1
+
+def analyse(text, options, profile=None, profile_path=None, **fields):
+    '''Finds the repeats in one text with a new SubstringAnalyser built from options. Runs in the worker
+pool, so only the RepeatIndex of the text is sent back, never the tree, with the event of the stage.'''
+    sa = SubstringAnalyser(**options)
+    with Stage('repeats', profile, profile_path, **fields) as event:
+        text = sa.encode(text)
+        index = sa.index_repeats(text, event)
+    return index, event
 
 class SubstringAnalyser():
     '''Contains a dictionary with metadata about each text and analysis results populated by
 the corresponding suffix tree. Output is via a generator method also contained in the dictionary.
 Also has methods to save the data to an excel sheet at a user-specified filepath.'''
 
-    def __init__(self, min_length=2, min_occurrences=2, spaced=False):
+    def __init__(self, min_length=2, min_occurrences=2, spaced=False, engine='stree', mode='maximal',
+                 max_workers=None, pool='process', index_path=None, incremental=False,
+                 observer=None, profile=None, profile_path=None, top_k=None, score='occurrences',
+                 termhood='cvalue', shard_size=None, max_term_length=32):
         '''Args:
 spaced: whether the text has words split by spaces or not.
 min_length: the minimum length in characters (in words if the text is spaced) of substrings in the results.
 min_occurrences: minimum number of occurrences before a substring is included in the results.
-Higher values for min_length and min_occurrences produce less results and slightly better performance.'''
+Higher values for min_length and min_occurrences produce less results and slightly better performance.
+engine: 'stree' builds suffix trees, 'suffix_array' uses suffix and LCP arrays, which give the same
+results in a fraction of the memory.
+mode: one of MODES. The default, 'maximal', skips substrings with the same occurrences as a longer one.
+max_workers: how many texts are analysed at once. None uses every CPU, and 1 analyses them in this thread.
+pool: 'process' analyses texts in worker processes, 'thread' in threads, which only helps for small texts.
+index_path: a directory where the RepeatIndex of every text is saved, so a text that was analysed before
+with the same spaced option and mode is read back instead, whatever the thresholds.
+incremental: keep a CommonIndex of the texts, so load_common only adds the texts loaded since it was
+last called, and remove takes texts out of it, instead of building a generalised suffix tree over every
+text each time. Needs the 'stree' engine, and keeps the tree in memory between calls.
+observer: called with an event (see lib.instrumentation) as each text is analysed, as the common
+substrings are found and as the output is saved. The default prints the loading messages.
+profile: 'cprofile' or 'tracemalloc' to profile every stage, and save the profiles in profile_path.
+top_k: keep only the top_k repeats of each text with the highest score, one of SCORES, ranked by it in the
+output. With index_path, the whole RepeatIndex is still kept, so thresholds, top_k and score can change without
+analysing again. Otherwise only the top_k repeats are decoded and kept (unless termhood is 'ncvalue', which
+needs every repeat), and texts are analysed again when those settings change. Every node of the tree is still
+read, a few integers each, to count the repeats nested in them.
+termhood: one of TERMHOOD, the score given to every repeat in the output.
+shard_size: texts of more symbols (characters, or words and punctuation for spaced texts) than this are
+split into shards of at most shard_size symbols, at paragraph or sentence ends where there are any, which
+are sorted in the worker pool and merged (see ShardedEngine). Only repeats of up to max_term_length symbols
+are found in those texts, but they are counted exactly, as though the text was analysed whole. Once any
+text is sharded, common substrings are only found up to max_term_length symbols too, from the shards of
+every text, and they can't be kept incremental.'''
+        if engine not in ENGINES:
+            raise Exception('Unknown engine {}.'.format(engine))
+        if mode not in MODES:
+            raise Exception('Unknown mode {}.'.format(mode))
+        if pool not in POOLS:
+            raise Exception('Unknown pool {}.'.format(pool))
+        if score not in SCORES:
+            raise Exception('Unknown score {}.'.format(score))
+        if termhood not in TERMHOOD:
+            raise Exception('Unknown termhood score {}.'.format(termhood))
+        if shard_size is not None and (shard_size < 1 or max_term_length < 1):
+            raise Exception('Shards and terms must be at least one symbol long.')
+        if incremental and engine != 'stree':
+            raise Exception('Incremental common substrings need the stree engine.')
+        if incremental and shard_size is not None:
+            raise Exception('Incremental common substrings can\'t be kept for texts analysed in shards.')
+        self.options = {'min_length' : min_length, 'min_occurrences' : min_occurrences, 'spaced' : spaced,
+                        'engine' : engine, 'mode' : mode, 'termhood' : termhood, 'score' : score,
+                        'top_k' : None if index_path else top_k} # Workers only cut indexes which aren't saved
+        self.max_workers = max_workers
+        self.index_path = index_path
+        self.indexes = {}
+        self.pool = POOLS[pool]
+        self.engine = ENGINES[engine]
+        self.mode = mode
         self.spaced = spaced
         self.min_length = min_length
         self.min_occurrences = min_occurrences
+        self.top_k = top_k
+        self.score = score
+        self.termhood = termhood
+        self.shard_size = shard_size
+        self.max_term_length = max_term_length
+        self.vocabulary = Vocabulary()
+        self.punctuation = re.compile('([{}]+)'.format(re.escape(SPACED_PUNCTUATION if spaced else UNSPACED_PUNCTUATION)))
+        self.counted = bytearray() # For spaced texts, 1 for each token id which counts towards lengths
         self.data = []
         self.common = {'results' : [], 'clean_results' : []}
         self.common['output'] = self.get_output(self.common)
+        self.incremental = incremental
+        self.observer = observer or print_loading
+        self.profile = profile
+        self.profile_path = profile_path
+        self.common_index = None # Built by the first load_common with incremental
+        self.common_texts = [] # Number in common_index of each text added to it, in data order
+        self.common_labels = {} # (idx, depth) of common_index nodes to their (label, substring)
+        self.common_prefix = None # prefix_sums of the masks of the texts in common_index, laid out as its buffer
 
     def load(self, data_in):
-        '''Data can be passed in as a string "text", a tuple (filename, text), or a list of tuples.'''
+        '''Data can be passed in as a string "text", a tuple (filename, text), or a list of tuples.
+The text in a tuple can also be an iterable of blocks of text, such as TextExtractor.extract_chunks yields.
+With shard_size set, blocks of spaced texts are split into tokens as they are read (see read), so a text
+which is analysed in shards is never held whole as a string. Other blocks are joined into one text.
+Texts are analysed in a pool of at most max_workers workers, and results are stored in input order.
+A text that fails, or whose blocks raise as they are read, keeps empty results and an 'error' entry, and the
+failures are raised together at the end.'''
         if isinstance(data_in, str):
             data_in = [('', data_in)]
         if isinstance(data_in, tuple):
             data_in = [data_in]
-        if isinstance(data_in, list):
-            threads = []
-            for i, d in enumerate(data_in):
-                print('Loading {}'.format(i))
-                self.data.append({'filename' : d[0], 'index' : i})
-                threads.append( Thread(target=self.process_data, args=(d[1],i)) )
-                threads[i].start()
-            for t in threads:
-                t.join()
-        else:
+        if not isinstance(data_in, list):
             raise Exception('TermExtractor can only load strings or lists of strings.')
 
-    def load_common(self):
-        '''This method has to be called manually to populate the common substrings data.'''
-        print('Loading common')
-        if len(self.data) > 1:
-            self.common['results'] = self.get_common(texts=list(d['text'] for d in self.data))
+        start = len(self.data)
+        sources = [] # Texts sent to the workers, None for sharded texts
+        failed = {} # Exceptions raised reading texts, by position
+        for i, d in enumerate(data_in, start):
+            try:
+                text, digest = self.read(d[1])
+            except Exception as e: # Such as blocks of a file which failed to extract
+                failed[i] = e
+                text, digest = self.encode(''), ''
+            sharded = self.sharded(text)
+            self.data.append({'filename' : d[0], 'index' : i, 'text' : text, 'mask' : None if sharded else self.mask(text),
+                              'key' : self.key(digest, sharded)}) # Sharded texts are never masked whole
+            sources.append(None if sharded else d[1] if isinstance(d[1], str) else ''.join(self.decode(text)))
+        keys = [d['key'] for d in self.data[start:]]
+        found = [self.find_index(k) for k in keys]
+        found = [failed.get(i) or ((f, {'stage' : 'repeats', 'cached' : True}) if f else None) for i, f in enumerate(found, start)]
+        tasks = [(s, self.options, self.profile, self.profile_path) for s in sources]
+        fields = [{'document' : d['index'], 'filename' : d['filename']} for d in self.data[start:]]
+        texts = [d['text'] for d in self.data[start:]] # Sharded texts are merged in this thread, as they are encoded
 
-    def process_data(self, text, i):
-        '''Splits spaced texts into a list of strings, then populates the dictionary entry for the text.'''
-        if self.spaced:
-            self.punctuation = '([{}]+)'.format(re.escape('\'!"()*,./:;<>?[]{} \n\t'))
-            text = re.split(self.punctuation, text)
+        if self.max_workers == 1:
+            results = (f or (self.run(self.analyse_sharded, s, **x) if self.sharded(s) else self.run(analyse, *t, **x))
+                       for f, s, t, x in zip(found, texts, tasks, fields))
+            self.store(start, results)
         else:
-            self.punctuation = '([{}]+)'.format(re.escape(' \n\t。、（）「」　？・'))
-        results = self.get_repeats(text)
-        d = {'text': text, 'results' : results, 'clean_results' : []}
+            with self.pool(max_workers=self.max_workers) as pool:
+                futures = [None if f or self.sharded(s) else pool.submit(analyse, *t, **x) for f, s, t, x in zip(found, texts, tasks, fields)]
+                self.store(start, (f or (self.run(future.result) if future else self.run(self.analyse_sharded, s, pool.map, **x))
+                                   for f, future, s, x in zip(found, futures, texts, fields)))
+
+        errors = ['{} ({}): {}'.format(d['index'], d['filename'], d['error']) for d in self.data[start:] if 'error' in d]
+        if errors:
+            raise Exception('Could not analyse {} of {} texts:\n{}'.format(len(errors), len(data_in), '\n'.join(errors)))
+
+    def run(self, f, *args, **kwargs):
+        '''Returns f(*args, **kwargs), or the exception it raised, so one text can't stop the others loading.'''
+        try:
+            return f(*args, **kwargs)
+        except Exception as e:
+            return e
+
+    def store(self, start, results):
+        '''Populates the dictionary entries from start onwards with the results of each (RepeatIndex, event)
+pair or exception, taken in input order, and passes on the events.'''
+        for i, result in enumerate(results, start):
+            d = self.data[i]
+            if isinstance(result, Exception):
+                d['error'] = result
+                event = {'stage' : 'repeats', 'error' : result}
+            else:
+                index, event = result
+                self.save_index(d['key'], index)
+            self.filter(d)
+            event.update(document=i, filename=d['filename'], done=i - start + 1, total=len(self.data) - start,
+                         results=len(d['results']))
+            self.observer(event)
+
+    def read(self, text):
+        '''Returns an input text, a string or an iterable of blocks, encoded, with the sha256 hex digest of it.
+With shard_size set, blocks of spaced texts are tokenized and hashed as they are read instead of joined.'''
+        digest = hashlib.sha256()
+        if isinstance(text, str) or not (self.spaced and self.shard_size is not None):
+            text = text if isinstance(text, str) else ''.join(text)
+            digest.update(text.encode('utf-8', 'surrogatepass'))
+            return self.encode(text), digest.hexdigest()
+
+        def hashed(blocks):
+            for block in blocks:
+                digest.update(block.encode('utf-8', 'surrogatepass'))
+                yield block
+        encoded = self.vocabulary.encode(tokenize_blocks(self.punctuation, hashed(text)))
+        return encoded, digest.hexdigest()
+
+    def key(self, digest, sharded=False):
+        '''Returns the key of the RepeatIndex of a text, from the hex digest of the text and the options its repeats depend on.'''
+        key = '{}-{}-{}-{}'.format(digest, 'spaced' if self.spaced else 'unspaced', self.mode, self.termhood)
+        return key + '-{}'.format(self.max_term_length) if sharded else key
+
+    def sharded(self, text):
+        '''Returns True if an encoded text is analysed in shards.'''
+        return self.shard_size is not None and len(text) > self.shard_size
+
+    def split(self, text):
+        '''Returns the (start, end) of the shards of an encoded text. Each ends after the last paragraph end in
+its second half, or else the last sentence end, or else after shard_size symbols.'''
+        bounds = []
+        start = 0
+        while len(text) - start > self.shard_size:
+            half = start + self.shard_size // 2
+            symbols = self.decode(text[half:start + self.shard_size])
+            end = start + self.shard_size
+            for marks in BREAKS:
+                i = last_break(symbols, marks)
+                if i != -1:
+                    end = half + i + 1
+                    break
+            bounds.append((start, end))
+            start = end
+        bounds.append((start, len(text)))
+        return bounds
+
+    def analyse_sharded(self, text, map=map, **fields):
+        '''Finds the repeats of an encoded text in shards, sorted by map, such as the map of the worker pool,
+and returns its RepeatIndex and the event of the stage, as analyse does.'''
+        with Stage('repeats', self.profile, self.profile_path, **fields) as event:
+            bounds = self.split(text)
+            index = self.index_repeats(text, event, ShardedEngine(text, bounds, self.max_term_length, map))
+            event['shards'] = len(bounds)
+        return index, event
+
+    def find_index(self, key):
+        '''Returns the RepeatIndex for key from memory or from index_path, or None.'''
+        if key not in self.indexes and self.index_path:
+            index = RepeatIndex.load(Path(self.index_path, key))
+            if index is not None:
+                self.indexes[key] = index
+        return self.indexes.get(key)
+
+    def save_index(self, key, index):
+        '''Keeps the RepeatIndex for key, and saves it to index_path if it is new.'''
+        if self.index_path and key not in self.indexes:
+            try:
+                index.save(Path(self.index_path, key))
+            except OSError as e: # The index can be built again
+                print('Could not save index: {}'.format(e))
+        self.indexes[key] = index
+
+    def filter(self, d):
+        '''Sets a text's results from its RepeatIndex at the current thresholds (the top_k of them by score,
+if set), and restarts its output.'''
+        index = self.indexes.get(d.get('key'))
+        if index and index.cut and index.cut != self.cut():
+            index = self.reindex(d)
+        if not index:
+            d['results'] = []
+        elif self.top_k:
+            d['results'] = index.top(self.top_k, self.min_length, self.min_occurrences, SCORES[self.score] or index.termhood,
+                                     'length' if self.score == 'length' else 'occurrences')
+        else:
+            d['results'] = index.query(self.min_length, self.min_occurrences)
+        d['clean_results'] = []
         d['output'] = self.get_output(d)
-        self.data[i].update(d)
+
+    def cut(self):
+        '''Returns the settings a RepeatIndex of only the top_k repeats is cut to, which it has to be built again
+for if they change.'''
+        return (self.top_k, self.score, self.min_length, self.min_occurrences)
+
+    def reindex(self, d):
+        '''Analyses a loaded text again in this thread, and returns its new RepeatIndex.'''
+        text = d['text']
+        if self.sharded(text):
+            index = self.analyse_sharded(text)[0]
+        else:
+            index = self.index_repeats(text)
+        self.indexes[d['key']] = index
+        return index
+
+    def set_thresholds(self, min_length, min_occurrences, top_k=None, score=None):
+        '''Changes the thresholds, and top_k and score if given, and filters every loaded text again, without
+analysing it again unless only its top_k repeats were kept. Common substrings are not indexed, so load_common
+has to be called again for those.'''
+        if score is not None and score not in SCORES:
+            raise Exception('Unknown score {}.'.format(score))
+        self.min_length = min_length
+        self.min_occurrences = min_occurrences
+        self.top_k = self.top_k if top_k is None else top_k
+        self.score = score or self.score
+        self.options.update(min_length=min_length, min_occurrences=min_occurrences, score=self.score,
+                            top_k=None if self.index_path else self.top_k)
+        for d in self.data:
+            self.filter(d)
+
+    def load_common(self):
+        '''This method has to be called manually to populate the common substrings data, and again
+after texts are loaded or removed. Restarts the common output.'''
+        with Stage('common', self.profile, self.profile_path, done=1, total=1) as event:
+            if self.incremental:
+                self.common['results'] = self.update_common(event)
+            elif len(self.data) > 1:
+                texts = [d['text'] for d in self.data]
+                masks = [d['mask'] for d in self.data]
+                if self.max_workers == 1 or not any(self.sharded(t) for t in texts):
+                    self.common['results'] = self.get_common(texts, event, masks)
+                else: # The shards are sorted in the worker pool
+                    with self.pool(max_workers=self.max_workers) as pool:
+                        self.common['results'] = self.get_common(texts, event, masks, pool.map)
+            else:
+                self.common['results'] = []
+            self.common['clean_results'] = []
+            self.common['output'] = self.get_output(self.common)
+            event.update(tokens=sum(len(d['text']) for d in self.data), results=len(self.common['results']))
+        self.observer(event)
+
+    def update_common(self, event=None):
+        '''Adds texts loaded since the last call to the CommonIndex, and returns its common substrings
+as get_common would, with the texts numbered by their position in data.'''
+        if self.common_index is None:
+            self.common_index = CommonIndex([d['text'] for d in self.data], self.mode)
+            self.common_texts = list(range(len(self.data)))
+            self.common_prefix = prefix_sums(b''.join(d['mask'] + b'\0' for d in self.data)) # Terminals don't count
+        for d in self.data[len(self.common_texts):]:
+            self.common_texts.append(self.common_index.add(d['text']))
+            last = self.common_prefix[-1]
+            self.common_prefix.extend(last + n for n in prefix_sums(d['mask'] + b'\0')[1:])
+        if event is not None:
+            event['nodes'] = self.common_index.engine.nodes()
+        if len(self.data) < 2:
+            return []
+        positions = {n : i for i, n in enumerate(self.common_texts)}
+        prefix = self.common_prefix
+        labels = {}
+        nodes = []
+        for idx, depth, idxs in self.common_index.common():
+            key = (idx, depth)
+            if key not in self.common_labels:
+                label = self.decode(self.common_index.label(idx, depth))
+                self.common_labels[key] = (label, self.common_label(label))
+            labels[key] = self.common_labels[key]
+            if prefix[idx + depth] - prefix[idx] >= self.min_length:
+                nodes.append((labels[key], depth, DocumentSet.of(positions[n] for n in idxs)))
+        self.common_labels = labels # Labels of nodes which are no longer common are dropped
+        return self.common_results(nodes)
+
+    def remove(self, i):
+        '''Removes the text at position i of data, and renumbers the texts after it. With incremental,
+it is also taken out of the CommonIndex. Call load_common to update the common substrings.'''
+        self.data.pop(i)
+        for j, d in enumerate(self.data[i:], i):
+            d['index'] = j
+        if self.common_index is not None and i < len(self.common_texts):
+            self.common_index.remove(self.common_texts.pop(i))
+
+    def encode(self, text):
+        '''Splits spaced texts into words and punctuation and encodes them as an array of token ids.
+Texts are encoded in this process, so token ids are shared by every text for the common substrings.'''
+        if self.spaced:
+            return self.vocabulary.encode(tokenize(self.punctuation, text))
+        return text
+
+    def mask(self, text):
+        '''Returns bytes with a 1 for every symbol of an encoded text which counts towards the length of a
+substring, and a 0 for punctuation and whitespace (a token containing any, for spaced texts). Characters
+are masked by runs of the pattern, and tokens by a table of token ids, which grows with the vocabulary.'''
+        if self.spaced:
+            return bytes(map(self.counts(), text))
+        mask = bytearray(b'\1') * len(text)
+        for m in self.punctuation.finditer(text):
+            mask[m.start():m.end()] = bytes(m.end() - m.start())
+        return bytes(mask)
+
+    def counts(self):
+        '''Returns a function giving 1 (or True) for a symbol of an encoded text which counts towards the length
+of a substring, as mask marks them.'''
+        if self.spaced:
+            with self.vocabulary.lock:
+                tokens = self.vocabulary.tokens
+                self.counted.extend(0 if self.punctuation.search(t) else 1 for t in tokens[len(self.counted):])
+            return self.counted.__getitem__
+        return lambda c: self.punctuation.match(c) is None
 
     def get_repeats(self, text):
-        '''Uses a suffix tree to find all repeated substrings in the text.'''
-        st = STree(text)
-        
-        def find_repeats(node):
-            '''Recursive method to traverse the suffix tree.'''
-            if node.is_leaf(): # Leaves never repeat
-                return []
-            repeats = []
-            edge = st._edgeLabel(node, node.parent)
-            if len(edge) >= 1: # Filters out single-letter strings and empty strings
-                substring = st.word[node.idx:node.idx + node.depth]
-                occurrences = len(node._get_leaves())
-                length = len(list(s for s in substring if not re.search(self.punctuation, s)))
-                if (occurrences >= self.min_occurrences) and (length >= self.min_length):
-                    repeats.append((substring, occurrences))
-            for (n,_) in node.transition_links:
-                for s in find_repeats(n):
-                    repeats.append(s)
-            return repeats
-
-        repeats = find_repeats(st.root)
-        
+        '''Uses a suffix tree or suffix array to find all repeated substrings in the text.'''
+        return self.index_repeats(text).query(self.min_length, self.min_occurrences)
+
+    def index_repeats(self, text, event=None, engine=None):
+        '''Finds every repeated substring in the text, at any thresholds, and returns them as a RepeatIndex
+with their termhood scores. Adds the size of the text and of the tree to event. engine is built over
+the text if it isn't given.'''
+        engine = engine or self.engine(text)
+        if event is not None:
+            event.update(tokens=len(text), nodes=engine.nodes())
+        counts = self.counts()
+        if self.sharded(text): # Repeats are at most max_term_length long, so no arrays as long as the text are needed
+            length = lambda idx, depth: sum(map(counts, text[idx:idx + depth]))
+        else:
+            prefix = prefix_sums(self.mask(text))
+            length = lambda idx, depth: prefix[idx + depth] - prefix[idx]
+        ncvalue = self.termhood == 'ncvalue'
+        if self.top_k and not self.index_path and not ncvalue:
+            return self.top_repeats(engine, text, length)
+
+        repeats = []
+        contexts = []
+        for idx, depth, occurrences, nested, nested_occurrences, following in self.nested_repeats(engine, ncvalue):
+            n = length(idx, depth)
+            repeats.append([self.repeat_label(engine, idx, depth), occurrences, n, c_value(occurrences, n, nested, nested_occurrences)])
+            if ncvalue: # Only symbols which count towards lengths, so no punctuation or end of text
+                contexts.append([(text[p], o) for p, o in following if p < len(text) and counts(text[p])])
+
+        if ncvalue:
+            for r, score in zip(repeats, nc_values([r[3] for r in repeats], contexts)):
+                r[3] = score
+        return RepeatIndex(repeats)
+
+    def top_repeats(self, engine, text, length):
+        '''Returns a RepeatIndex of only the top_k repeats by score at the current thresholds, keeping the best
+in a heap, so only those are decoded and sorted. With a score of occurrences and length, the heap is filled
+as the engine finds the repeats, and C-values are only worked out for those left in it. With termhood, they
+are worked out once nesting is done, only for the repeats which could still beat the worst in the heap.
+Ties are broken by occurrences and then by length in symbols, rather than in result order as RepeatIndex.top
+breaks them.'''
+        score = SCORES[self.score]
+        heap = [] # (score, occurrences, depth, idx, length, node)
+        def keep(item):
+            if len(heap) < self.top_k:
+                heappush(heap, item)
+            elif item > heap[0]:
+                heapreplace(heap, item)
+
+        def found(i, idx, depth, occurrences):
+            n = length(idx, depth)
+            if n >= self.min_length and occurrences >= self.min_occurrences:
+                keep((score(occurrences, n), occurrences, depth, idx, n, i))
+        nodes = self.read_nodes(engine, found=found if score else None)
+        nested, nested_occurrences = nesting(engine.ranks(), *nodes[:5])
+        idxs, depths, occurrences = nodes[:3]
+        if not score:
+            for i, f in enumerate(nodes[4]):
+                if not f or occurrences[i] < self.min_occurrences:
+                    continue
+                n = length(idxs[i], depths[i])
+                # The C-value is at most log2(n + 1) * occurrences, with nothing nested
+                if n < self.min_length or len(heap) == self.top_k and log2(n + 1) * occurrences[i] < heap[0][0]:
+                    continue
+                keep((c_value(occurrences[i], n, nested[i], nested_occurrences[i]), occurrences[i], depths[i], idxs[i], n, i))
+        repeats = [(self.repeat_label(engine, idx, depth), o, n, c_value(o, n, nested[i], nested_occurrences[i]))
+                   for s, o, depth, idx, n, i in heap]
+        return RepeatIndex(repeats, self.cut())
+
+    def read_nodes(self, engine, context=False, found=None):
+        '''Reads every node the engine finds into arrays, a few integers each, as nesting needs every node of the
+tree. Returns (idxs, depths, occurrences, ranks, found, following), where found is whether each is a repeat of
+the mode and following is a dict of the symbols following the repeats by node, with context. found, if given,
+is called with (node, idx, depth, occurrences) for each repeat as it is read.'''
+        idxs = array('i')
+        depths = array('i')
+        occurrences = array('i')
+        ranks = array('i')
+        repeats = bytearray()
+        following = {}
+        for idx, depth, o, rank, f, symbols in engine.repeats(self.mode, context):
+            if symbols is not None:
+                following[len(idxs)] = symbols
+            if f and found:
+                found(len(idxs), idx, depth, o)
+            idxs.append(idx)
+            depths.append(depth)
+            occurrences.append(o)
+            ranks.append(rank)
+            repeats.append(f)
+        return idxs, depths, occurrences, ranks, repeats, following
+
+    def nested_repeats(self, engine, context=False):
+        '''Yields the repeats the engine finds as (idx, depth, occurrences, nested, nested_occurrences, following),
+with the longer repeats each one occurs in counted by nesting.'''
+        idxs, depths, occurrences, ranks, found, following = self.read_nodes(engine, context)
+        nested, nested_occurrences = nesting(engine.ranks(), idxs, depths, occurrences, ranks, found)
+        for i, f in enumerate(found):
+            if f:
+                yield (idxs[i], depths[i], occurrences[i], nested[i], nested_occurrences[i], following.get(i))
+
+    def repeat_label(self, engine, idx, depth):
+        '''Returns the output substring of a repeat of length depth at idx.'''
+        substring = self.decode(engine.label(idx, depth))
         if self.spaced: # Converts spaced text back into a string.
-            for i, repeat in enumerate(repeats):
-                substring = ''.join(w for w in repeat[0])
-                substring = substring.strip()
-                repeats[i] = (substring, repeat[1])
-
-        repeats.sort(key=lambda r: len(r[0])) #sort by length
-        repeats.sort(key=lambda r: r[1]) #sort by number of occurrences
-
-        return repeats
-
-    def get_common(self, texts):
-        '''Uses a generalised suffix tree to find all common substrings between the texts.'''
-        gst = STree(texts, gst=True)
-        
-        def find_common(node):
-            '''Recursive method to traverse the GST.'''
-            nodes = []
-            for (n,_) in node.transition_links:
-                if len(n.generalized_idxs) > 1:
-                    for c in find_common(n):
-                        nodes.append(c)
-            if nodes == []:
-                return [node]
-            return nodes
-
-        common_nodes = find_common(gst.root)
-        common_nodes.sort(key=lambda n: n.depth)
-        common_substrings = []
-        for node in common_nodes:
-            substring = gst.word[node.idx:node.idx+node.depth]
-            length = len(list(s for s in substring if not re.search(self.punctuation, s)))
-            if length >= self.min_length:
-                common_substrings.append((substring,node.generalized_idxs))
-
-        for i, cs in enumerate(common_substrings): #GST uses list format, so both spaced and nonspaced text has to be converted back to strings.
-            substring = ''.join(w for w in cs[0])
-            substring = substring.strip()
-            common_substrings[i] = (substring, cs[1])
-
-        return common_substrings
+            substring = ''.join(w for w in substring).strip()
+        return substring
+
+    def get_common(self, texts, event=None, masks=None, map=map):
+        '''Uses a generalised suffix tree or suffix array to find all common substrings between the texts.
+masks are those of the texts, if they have already been made. If any of the texts is sharded, only common
+substrings of up to max_term_length symbols are found, from the shards of every text sorted by map and
+merged (see ShardedEngine), so no engine or mask of the whole texts is built.'''
+        if any(self.sharded(t) for t in texts):
+            engine = ShardedEngine(texts, [self.split(t) for t in texts], self.max_term_length, map, gst=True)
+            counts = self.counts()
+            length = lambda idx, depth: sum(1 for s in engine.label(idx, depth) if counts(s))
+        else:
+            engine = self.engine(texts, gst=True)
+            masks = masks or [self.mask(t) for t in texts]
+            prefix = prefix_sums(b''.join(m + b'\0' for m in masks)) # Laid out like the engine's buffer, terminals not counting
+            length = lambda idx, depth: prefix[idx + depth] - prefix[idx]
+        if event is not None:
+            event['nodes'] = engine.nodes()
+
+        common_nodes = []
+        for idx, depth, idxs in engine.common(self.mode):
+            if length(idx, depth) >= self.min_length:
+                label = self.decode(engine.label(idx, depth))
+                common_nodes.append(((label, self.common_label(label)), depth, idxs))
+        return self.common_results(common_nodes)
+
+    def common_results(self, nodes):
+        '''Sorts common nodes ((label, substring), depth, idxs) by depth and returns (substring, idxs) for each.
+The engines only check the symbols either side of a label, so once whitespace is stripped off it, a substring
+can be part of a longer one output before it. Stripped substrings are left out if they are.'''
+        nodes.sort(key=lambda n: (n[1], len(n[0][1]), n[0][0])) #sort ties by stripped length, then alphabetically
+        results = []
+        covered = '' # Substrings output so far, each followed by a null
+        for (label, substring), depth, idxs in reversed(nodes):
+            if substring != ''.join(label) and substring in covered:
+                continue
+            results.append((substring, idxs))
+            covered += substring + '\0'
+        results.reverse()
+        return results
+
+    def common_label(self, substring):
+        '''Returns the output substring for the decoded label of a common node.'''
+        #GST uses list format, so both spaced and nonspaced text has to be converted back to strings.
+        return ''.join(w for w in substring).strip()
+
+    def decode(self, symbols):
+        '''Turns a slice of an indexed text back into tokens. Spaced texts are indexed as token ids.'''
+        if self.spaced:
+            return self.vocabulary.decode(symbols)
+        return symbols
 
     def get_output(self, data):
-        '''Generator for output - I don't know how to implement an online ST, so redundant substrings are filtered
-iteratively, which takes non-linear time. Generator gives a better UX until I learn how to improve performance.'''
+        '''Generator for output. Redundant substrings were already left out of the results by the engine,
+so this only skips substrings which come out the same as an earlier one once whitespace is stripped.'''
+        seen = set()
         while True:
             try:
                 result = data['results'].pop()
-                if not any (result[0] in r[0] for r in data['clean_results']):
+                if result[0] not in seen:
+                    seen.add(result[0])
                     data['clean_results'].append(result)
                     yield result
             except IndexError:
                 break
 
-    def save_output(self, path):
-        '''Manages threads for saving the output.'''
-        wb = xlsxwriter.Workbook(path)
+    def export(self, path, format=None):
+        '''Saves the output to path as xlsx or one of EXPORTERS, chosen by format or else by the file extension.
+Rows are written as the output generators produce them.'''
+        format = format or os.path.splitext(str(path))[1].lstrip('.').lower()
+        if format == 'xlsx':
+            return self.save_output(path)
+        if format not in EXPORTERS:
+            raise Exception('Unknown export format {}.'.format(format))
+        with Stage('save', self.profile, self.profile_path, filename=str(path), done=1, total=1) as event:
+            event['results'] = 0
+            with EXPORTERS[format](path) as exporter:
+                for row in self.rows():
+                    exporter.write(row)
+                    event['results'] += 1
+        self.observer(event)
 
-        threads = []
+    def rows(self):
+        '''Generator for (document, substring, occurrences, documents, length, score) rows of the whole output,
+with the common substrings first. Repeats have no documents and common substrings have no document,
+occurrences or score.'''
+        names = [d['filename'] for d in self.data]
         if len(self.data) > 1:
-            threads.append( Thread(target=self.save_common, args=(wb,)) )
+            for substring, idxs in self.common['output']:
+                yield (None, substring, None, [names[i] for i in idxs], len(substring), None)
         for d in self.data:
-            threads.append(Thread(target=self.save_repeats, args=(d, wb)))
-        for t in threads:
-            t.start()
-        for t in threads:
-            t.join()
+            for substring, occurrences, score in d['output']:
+                yield (d['filename'], substring, occurrences, None, len(substring), score)
 
-        wb.close()
+    def save_output(self, path):
+        '''Saves the output to an excel workbook at path. Sheets are written one after the other by this thread,
+in constant memory mode, so each row is flushed to disk as soon as the next one is written. Each sheet is
+a 'save' event, and closing the workbook is part of the last one.'''
+        wb = xlsxwriter.Workbook(path, {'constant_memory' : True})
+        sheets = [None] + self.data if len(self.data) > 1 else self.data
+        for done, d in enumerate(sheets, 1):
+            fields = {'document' : d['index'], 'filename' : d['filename']} if d else {'filename' : 'Common substrings'}
+            with Stage('save', self.profile, self.profile_path, done=done, total=len(sheets), **fields) as event:
+                event['results'] = self.save_repeats(d, wb) if d else self.save_common(wb)
+                if done == len(sheets):
+                    wb.close()
+            self.observer(event)
+        if not sheets:
+            wb.close()
 
     def save_common(self, wb):
         '''Writes out results to excel in three-column format.'''
-        sheet = wb.add_worksheet('Common substrings')
-        sheet.set_column(0, 0, 60)
-        sheet.write(0, 0, 'SUBSTRING')
-        sheet.write(0, 1, 'APPEARS IN')
-        sheet.write(0, 2, 'LENGTH')
-
-        i = 1
-        while True:
-            try:
-                out = next(self.common['output'])
-                sheet.write(i, 0, out[0])
-                sheet.write(i, 1, repr(out[1]).strip('{}'))
-                sheet.write(i, 2, len(out[0]))
-            except StopIteration:
-                sheet.autofilter(0 ,0 ,i, 2)
-                break
-            i = i + 1
+        rows = ((out[0], repr(out[1]).strip('{}'), len(out[0])) for out in self.common['output'])
+        return self.save_sheets(wb, 'Common substrings', ('SUBSTRING', 'APPEARS IN', 'LENGTH'), rows)
 
     def save_repeats(self, d, wb):
-        '''Writes out results to excel in three-column format.'''
+        '''Writes out results to excel in four-column format, with the termhood score last.'''
         excel_banned= '[{}]'.format(re.escape('[]:*?/\\'))
         filename = re.sub(excel_banned, '', d['filename'])
-        sheet = wb.add_worksheet('{}： {}'.format(d['index'], d['filename'][:20]))
-        sheet.set_column(0, 0, 60)
-        sheet.write(0, 0, 'SUBSTRING')
-        sheet.write(0, 1, 'OCCURRENCES')
-        sheet.write(0, 2, 'LENGTH')
-        
-        i = 1
-        while True:
-            try:
-                out = next(d['output'])
-                sheet.write(i, 0, out[0])
-                sheet.write(i, 1, out[1])
-                sheet.write(i, 2, len(out[0]))
-            except StopIteration:
-                sheet.autofilter(0 ,0 ,i, 2)
-                break
+        rows = ((out[0], out[1], len(out[0]), out[2]) for out in d['output'])
+        header = ('SUBSTRING', 'OCCURRENCES', 'LENGTH', 'NC-VALUE' if self.termhood == 'ncvalue' else 'C-VALUE')
+        return self.save_sheets(wb, '{}： {}'.format(d['index'], filename[:20]), header, rows)
+
+    def save_sheets(self, wb, name, header, rows):
+        '''Writes rows to a sheet below the header. When the sheet reaches EXCEL_ROWS, the rest go to
+continuation sheets named "name (2)", "name (3)" and so on. Returns the number of rows written.'''
+        sheet = self.add_sheet(wb, name, header)
+        sheets = 1
+        i = 0
+        for row in rows:
+            if i == EXCEL_ROWS - 1:
+                sheet.autofilter(0, 0, i, len(header) - 1)
+                sheets = sheets + 1
+                suffix = ' ({})'.format(sheets)
+                sheet = self.add_sheet(wb, name[:31 - len(suffix)] + suffix, header) # Sheet names are limited to 31 characters
+                i = 0
             i = i + 1
+            sheet.write_row(i, 0, row)
+        sheet.autofilter(0, 0, i, len(header) - 1)
+        return (sheets - 1) * (EXCEL_ROWS - 1) + i
+
+    def add_sheet(self, wb, name, header):
+        '''Adds a sheet with a wide first column and the header in the first row.'''
+        sheet = wb.add_worksheet(name)
+        sheet.set_column(0, 0, 60)
+        sheet.write_row(0, 0, header)
+        return sheet
@@ -0,0 +1,244 @@
+from array import array
+from bisect import bisect_right
+from heapq import merge
+from itertools import accumulate
+
+def sa_is(s, upper):
+    '''Builds the suffix array of s, a list of ints in range(upper + 1), with the SA-IS algorithm.
+
+Nong, Zhang and Chan, "Two Efficient Algorithms for Linear Time Suffix Array Construction" - IEEE, 2011.
+The layout follows the AtCoder Library implementation. No sentinel is needed at the end of s.'''
+    n = len(s)
+    if n == 0:
+        return array('i')
+    if n == 1:
+        return array('i', [0])
+    if n == 2:
+        return array('i', [0, 1] if s[0] < s[1] else [1, 0])
+
+    sa = array('i', bytes(4 * n))
+    ls = bytearray(n) # 1 where the suffix is S-type
+    for i in range(n - 2, -1, -1):
+        ls[i] = ls[i + 1] if s[i] == s[i + 1] else s[i] < s[i + 1]
+
+    sum_l = [0] * (upper + 1)
+    sum_s = [0] * (upper + 1)
+    for i in range(n):
+        if not ls[i]:
+            sum_s[s[i]] += 1
+        else:
+            sum_l[s[i] + 1] += 1
+    for i in range(upper + 1):
+        sum_s[i] += sum_l[i]
+        if i < upper:
+            sum_l[i + 1] += sum_s[i]
+
+    def induce(lms):
+        '''Induced sorting of L-type then S-type suffixes from the sorted LMS suffixes.'''
+        for i in range(n):
+            sa[i] = -1
+        buf = sum_s[:]
+        for d in lms:
+            if d == n:
+                continue
+            sa[buf[s[d]]] = d
+            buf[s[d]] += 1
+        buf = sum_l[:]
+        sa[buf[s[n - 1]]] = n - 1
+        buf[s[n - 1]] += 1
+        for i in range(n):
+            v = sa[i]
+            if v >= 1 and not ls[v - 1]:
+                sa[buf[s[v - 1]]] = v - 1
+                buf[s[v - 1]] += 1
+        buf = sum_l[:]
+        for i in range(n - 1, -1, -1):
+            v = sa[i]
+            if v >= 1 and ls[v - 1]:
+                buf[s[v - 1] + 1] -= 1
+                sa[buf[s[v - 1] + 1]] = v - 1
+
+    lms_map = array('i', [-1]) * (n + 1)
+    lms = array('i')
+    for i in range(1, n):
+        if not ls[i - 1] and ls[i]:
+            lms_map[i] = len(lms)
+            lms.append(i)
+    m = len(lms)
+    induce(lms)
+
+    if m:
+        sorted_lms = array('i', (v for v in sa if lms_map[v] != -1))
+        rec_s = array('i', bytes(4 * m))
+        rec_upper = 0
+        for i in range(1, m):
+            l = sorted_lms[i - 1]
+            r = sorted_lms[i]
+            end_l = lms[lms_map[l] + 1] if lms_map[l] + 1 < m else n
+            end_r = lms[lms_map[r] + 1] if lms_map[r] + 1 < m else n
+            same = True
+            if end_l - l != end_r - r:
+                same = False
+            else:
+                while l < end_l:
+                    if s[l] != s[r]:
+                        break
+                    l += 1
+                    r += 1
+                if l == n or s[l] != s[r]:
+                    same = False
+            if not same:
+                rec_upper += 1
+            rec_s[lms_map[sorted_lms[i]]] = rec_upper
+        rec_sa = sa_is(rec_s, rec_upper)
+        for i in range(m):
+            sorted_lms[i] = lms[rec_sa[i]]
+        induce(sorted_lms)
+
+    return sa
+
+def kasai(s, sa):
+    '''Returns the LCP array of s: lcp[i] is the length of the longest common prefix
+of the suffixes at sa[i - 1] and sa[i], and lcp[0] is 0. Kasai et al., 2001.'''
+    n = len(s)
+    rank = array('i', bytes(4 * n))
+    for i, p in enumerate(sa):
+        rank[p] = i
+    lcp = array('i', bytes(4 * n))
+    h = 0
+    for i in range(n):
+        r = rank[i]
+        if r == 0:
+            h = 0
+            continue
+        j = sa[r - 1]
+        while i + h < n and j + h < n and s[i + h] == s[j + h]:
+            h += 1
+        lcp[r] = h
+        if h > 0:
+            h -= 1
+    return lcp
+
+class SuffixArray():
+    '''Suffix array and LCP array over a string or a list of tokens. With gst=True the input is
+a list of texts, which are concatenated with a unique separator after each one, and doc maps
+every position to the index of its text.
+
+Symbols are ranked to dense ints before construction, so the alphabet can be anything sortable.
+The finished index keeps sa, lcp and doc as 4-byte arrays (12 bytes per input symbol) and
+reads substrings back out of the input texts.'''
+
+    def __init__(self, input, gst=False):
+        self.texts = input if gst else [input]
+        separators = len(self.texts) if gst else 0
+        symbols = sorted(set(c for t in self.texts for c in t))
+        rank = {c: i + separators for i, c in enumerate(symbols)}
+
+        s = array('i')
+        self.doc = array('i')
+        self.word_starts = []
+        for i, t in enumerate(self.texts):
+            self.word_starts.append(len(s))
+            s.extend(rank[c] for c in t)
+            if gst:
+                s.append(i)
+                self.doc.extend(array('i', [i]) * (len(t) + 1))
+
+        upper = len(symbols) + separators - 1
+        self.sa = sa_is(s, max(upper, 0))
+        self.lcp = kasai(s, self.sa)
+
+    def __len__(self):
+        return len(self.sa)
+
+    def suffixes(self):
+        '''Returns (position, lcp) for every suffix in sorted order, where lcp is the length of the prefix it
+shares with the one before.'''
+        return zip(self.sa, self.lcp)
+
+    def label(self, idx, depth):
+        '''Returns the depth symbols starting at position idx, which must not cross a separator.'''
+        n = bisect_right(self.word_starts, idx) - 1
+        offset = idx - self.word_starts[n]
+        return self.texts[n][offset:offset + depth]
+
+    def preceding(self, idx):
+        '''Returns the symbol before position idx, or -(n + 1) at the start of text n, which
+no symbol or other text start is equal to.'''
+        n = bisect_right(self.word_starts, idx) - 1
+        offset = idx - self.word_starts[n]
+        return self.texts[n][offset - 1] if offset else -(n + 1)
+
+def sort_chunk(chunk, start, core):
+    '''Returns the positions, counted from start, of the suffixes which start in the first core symbols of
+chunk, in the order of a suffix array of chunk. Runs in a worker of ShardedSuffixArray.'''
+    return array('i', (start + p for p in SuffixArray(chunk).sa if p < core))
+
+def common_length(a, b):
+    '''Returns the length of the longest common prefix of two sequences.'''
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n = n + 1
+    return n
+
+class ShardedSuffixArray():
+    '''The suffixes of one text in sorted order, sorted only as deep as depth, from shards of the text which
+are sorted apart, so no process builds a suffix array of the whole text.
+
+bounds are the (start, end) of the shards, which cover the text. Each shard is sorted with the depth
+symbols after it, so every suffix starting in it is ordered by at least its first depth symbols, and
+suffixes merges the sorted shards by those symbols as it is read, so neither a suffix array nor an LCP
+array of the whole text is kept. LCPs are exact up to depth and depth where they are deeper, so only
+intervals with an LCP under depth are the same as in a SuffixArray of the text. map runs sort_chunk
+over the shards, such as the map of a pool of workers.
+
+With gst=True the input is a list of texts and bounds a list of the bounds of each, laid out as in
+a SuffixArray with gst=True, apart from the suffixes starting at the separators, which are left out.'''
+
+    def __init__(self, input, bounds, depth, map=map, gst=False):
+        self.texts = input if gst else [input]
+        bounds = bounds if gst else [bounds]
+        self.word_starts = list(accumulate((len(t) + 1 for t in self.texts[:-1]), initial=0))
+        self.depth = depth
+        shards = [(t, w, s, e) for t, w, b in zip(self.texts, self.word_starts, bounds) for s, e in b]
+        self.chunks = list(map(sort_chunk, (t[s:e + depth] for t, w, s, e in shards), (w + s for t, w, s, e in shards),
+                               (e - s for t, w, s, e in shards)))
+        self.ranks = array('i', bytes(4 * (self.word_starts[-1] + len(self.texts[-1])))) # Filled in by suffixes
+
+    def __len__(self):
+        return sum(len(t) for t in self.texts)
+
+    def suffixes(self):
+        '''Yields (position, lcp) for every suffix in sorted order, as SuffixArray.suffixes does, merging the
+shards as it goes, and records the rank of each suffix in ranks. Suffixes of different texts which are the
+same up to the end of both keep the order of their texts, as the separators sort them.'''
+        depth = self.depth
+        if len(self.texts) == 1:
+            text = self.texts[0]
+            key = lambda p: text[p:p + depth]
+        else:
+            key = lambda p: self.label(p, depth)
+        previous = None
+        for rank, p in enumerate(merge(*self.chunks, key=key)):
+            suffix = key(p)
+            self.ranks[p] = rank
+            yield (p, 0 if previous is None else common_length(previous, suffix))
+            previous = suffix
+
+    def label(self, idx, depth):
+        '''Returns the depth symbols starting at position idx, or fewer at the end of its text.'''
+        n = bisect_right(self.word_starts, idx) - 1
+        offset = idx - self.word_starts[n]
+        return self.texts[n][offset:offset + depth]
+
+    def preceding(self, idx):
+        '''Returns the symbol before position idx, or -(n + 1) at the start of text n, as SuffixArray.preceding does.'''
+        n = bisect_right(self.word_starts, idx) - 1
+        offset = idx - self.word_starts[n]
+        return self.texts[n][offset - 1] if offset else -(n + 1)
+
+    def document(self, idx):
+        '''Returns the number of the text position idx is in.'''
+        return bisect_right(self.word_starts, idx) - 1
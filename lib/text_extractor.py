@@ -2,61 +2,169 @@ import docx, pptx, xlrd
 import PyPDF2
 import re
 from os import path
-from win32com import client
 from zipfile import BadZipFile
-from pywintypes import com_error
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from lib.plaintext import read_text, iter_text
+from lib.instrumentation import Stage
+try:
+    from win32com import client
+    from pywintypes import com_error
+except ImportError: # Office automation is only available on Windows
+    client = None
+    class com_error(Exception):
+        pass
+
+class PasswordError(Exception):
+    '''Raised for files which need a password, or a different one.'''
+
+def extract(cache, filepath, password, page_workers=1, profile=None, profile_path=None):
+    '''Extracts one file in a worker process of TextExtractor.extract_many, and returns the text with the
+counters of the worker's copy of the cache and the event of the extraction.'''
+    events = []
+    te = TextExtractor(cache, page_workers=page_workers, observer=events.append, profile=profile, profile_path=profile_path)
+    try:
+        return te.extract_text(filepath, password), cache.stats() if cache else None, events[0]
+    finally:
+        te.cleanup()
+
+PLAINTEXT = ['.txt', '.csv', '.xml', '.html', '.htm', '.rtf']
+
+def extract_pdf_pages(filepath, password, start, stop):
+    '''Extracts pages start to stop of a pdf in a worker process of TextExtractor.iter_pdf.'''
+    return list(TextExtractor().iter_pdf(filepath, password, start, stop))
+
+def chunk(texts, chunk_size):
+    '''Regroups an iterable of strings into strings of chunk_size characters, apart from the last.'''
+    buffer = ''
+    for text in texts:
+        buffer = buffer + text
+        start = 0
+        while len(buffer) - start >= chunk_size:
+            yield buffer[start:start + chunk_size]
+            start = start + chunk_size
+        buffer = buffer[start:]
+    if buffer:
+        yield buffer
 
 class TextExtractor():
 
-    def __init__(self):
+    VERSION = 2 # Change when extraction changes, so cached texts are extracted again
+    PAGES_PER_TASK = 50
+
+    def __init__(self, cache=None, page_workers=1, observer=None, profile=None, profile_path=None):
+        '''cache: an optional ExtractionCache, which must be created with version=TextExtractor.VERSION.
+page_workers: processes to extract the pages of a pdf with, if it has more than PAGES_PER_TASK pages.
+observer: called with an 'extract' event (see lib.instrumentation) for every file extracted.
+profile: 'cprofile' or 'tracemalloc' to profile every extraction, and save the profiles in profile_path.'''
         self.word = None
         self.excel = None
         self.pwpt = None
-        
+        self.cache = cache
+        self.page_workers = page_workers
+        self.observer = observer
+        self.profile = profile
+        self.profile_path = profile_path
+
     def extract_text(self, filepath, password=''):
+        with Stage('extract', self.profile, self.profile_path, filename=str(filepath)) as event:
+            hits = self.cache.hits if self.cache else 0
+            if self.cache == None:
+                text = self.extract_file(filepath, password)
+            else:
+                text = self.cache.extract(filepath, lambda: self.extract_file(filepath, password))
+            event.update(characters=len(text), cached=self.cache != None and self.cache.hits > hits)
+        if self.observer:
+            self.observer(event)
+        return text
+
+    def extract_many(self, filepaths, passwords=None, max_workers=None):
+        '''Extracts files in a pool of at most max_workers processes, and yields (filepath, text, error) as each
+one finishes, where error is None or the exception raised. Files which need a password fail with PasswordError,
+so they can be retried with extract_text once the password is known. passwords maps filepaths to passwords.
+The observer gets the event of each file from its worker, with its count done out of the total.
+Each worker splits large pdfs between page_workers processes of its own.'''
+        passwords = passwords or {}
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {pool.submit(extract, self.cache, f, passwords.get(f, ''), self.page_workers, self.profile, self.profile_path) : f for f in filepaths}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    text, stats, event = future.result()
+                except Exception as e:
+                    self.notify(filename=str(futures[future]), error=e, done=done, total=len(futures))
+                    yield (futures[future], None, e)
+                    continue
+                if stats:
+                    self.cache.merge(stats)
+                self.notify(**event, done=done, total=len(futures))
+                yield (futures[future], text, None)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    def notify(self, **event):
+        if self.observer:
+            self.observer(dict(event, stage='extract'))
+
+    def extract_file(self, filepath, password=''):
         filetype = filepath.suffix
     
-        if filetype in ['.txt', '.csv', '.xml', '.html', '.htm', '.rtf']:
+        if filetype in PLAINTEXT:
             return self.extract_plaintext(filepath, password)
         elif filetype == '.docx':
             return self.extract_docx(filepath, password)        
         elif filetype == '.doc':
             return self.open_in_word(filepath, password)
         elif filetype == '.pdf':
-            return extract_pdf(filepath, password)
+            return self.extract_pdf(filepath, password)
         elif filetype in ['.xls', '.xlsx']:
             return self.extract_xlsx(filepath, password)
         elif filetype == '.pptx':
             return self.extract_pptx(filepath, password)
         elif filetype == '.ppt':
-            return open_in_powerpoint(filepath, password)        
+            return self.open_in_powerpoint(filepath, password)        
         else:
             raise Exception('Document format {} not supported.'.format(filetype))
 
     def extract_plaintext(self, filepath, password=''):
-        try:
-            with filepath.open('r', encoding='utf-8-sig') as f:
-                return f.read()
-        except UnicodeDecodeError:
-            with filepath.open('r', encoding='ansi') as f:
-                return f.read()
+        return read_text(filepath)
 
     def extract_pdf(self, filepath, password=''):
+        return '\n'.join(self.iter_pdf(filepath, password, max_workers=self.page_workers))
+
+    def iter_pdf(self, filepath, password='', start=0, stop=None, max_workers=1):
+        '''Yields the text of each page of a pdf from start to stop, so pages don't have to be held
+at once. With max_workers other than 1, large pdfs are split into tasks of PAGES_PER_TASK pages for
+a pool of worker processes, and the pages are still yielded in order.'''
         try:
-            pdf = filepath.open('rb')
-            reader = PyPDF2.PdfFileReader(pdf)
-            if reader.isEncrypted and reader.decrypt(password) == 0:
-                raise Exception('Incorrect password.')
-            full_text = []
-            for page in range(reader.numPages):
-                p = reader.getPage(page)
-                full_text.append(p.extractText())
-            text = '\n'.join(full_text)
+            with filepath.open('rb') as pdf:
+                reader = PyPDF2.PdfFileReader(pdf)
+                if reader.isEncrypted and reader.decrypt(password) == 0:
+                    raise PasswordError('Incorrect password.')
+                stop = reader.numPages if stop == None else min(stop, reader.numPages)
+                if max_workers == 1 or stop - start <= self.PAGES_PER_TASK:
+                    for page in range(start, stop):
+                        yield reader.getPage(page).extractText()
+                    return
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                tasks = [pool.submit(extract_pdf_pages, filepath, password, i, min(i + self.PAGES_PER_TASK, stop))
+                         for i in range(start, stop, self.PAGES_PER_TASK)]
+                for task in tasks:
+                    yield from task.result()
         except NotImplementedError:
             raise Exception('Acrobat 6.0 encryption not supported.')
-        finally:
-            pdf.close()
-        return text
+
+    def extract_chunks(self, filepath, password='', chunk_size=1 << 20):
+        '''Yields the text of a file in blocks of chunk_size characters (the last may be shorter), which join up
+to the text extract_text returns. Pdfs and plaintext are streamed, so extraction never holds their whole text
+at once, though SubstringAnalyser.load still joins the blocks of a text unless shard_size is set and it is spaced.'''
+        if filepath.suffix in PLAINTEXT:
+            texts = iter_text(filepath, chunk_size)
+        elif filepath.suffix == '.pdf':
+            pages = self.iter_pdf(filepath, password, max_workers=self.page_workers)
+            texts = (text if i == 0 else '\n' + text for i, text in enumerate(pages))
+        else:
+            texts = [self.extract_text(filepath, password)]
+        return chunk(texts, chunk_size)
 
     def extract_docx(self, filepath, password=''):
         try:
@@ -74,6 +182,7 @@ class TextExtractor():
             password = ' '
         try:
             in_file = path.abspath(filepath)
+            self.check_office(filepath)
             if self.word == None:
                 self.word = client.DispatchEx('Word.Application')
                 self.word.Visible = 0
@@ -83,7 +192,7 @@ class TextExtractor():
             text = re.sub('\r', '\n', text)
         except com_error as e:
             if e.hresult == -2147352567:
-                raise Exception('Incorrect password.')
+                raise PasswordError('Incorrect password.')
             else:
                 raise
         return text
@@ -106,6 +215,7 @@ class TextExtractor():
             password = ' '
         try:
             in_file = path.abspath(filepath)
+            self.check_office(filepath)
             if self.excel == None:
                 self.excel = client.DispatchEx('Excel.Application')
                 self.excel.Visible = 0
@@ -121,7 +231,7 @@ class TextExtractor():
             wb.Close()
         except com_error as e:
             if e.hresult == -2147352567:
-                raise Exception('Incorrect password.')
+                raise PasswordError('Incorrect password.')
             else:
                 raise
         return text
@@ -141,6 +251,7 @@ class TextExtractor():
     def open_in_powerpoint(self, filepath, password=''):
         try:
             in_file = path.abspath(filepath)
+            self.check_office(filepath)
             if self.pwpt == None:
                 self.pwpt = client.DispatchEx('Powerpoint.Application')
             if (password == '') or (not isinstance(password, str)):
@@ -159,11 +270,15 @@ class TextExtractor():
                 window.Close()
         except com_error as e:
             if e.hresult == -2147352567:
-                raise Exception('Incorrect password.')
+                raise PasswordError('Incorrect password.')
             else:
                 raise
         return text
 
+    def check_office(self, filepath):
+        if client == None:
+            raise Exception('Opening {} files needs Microsoft Office on Windows.'.format(filepath.suffix))
+
     def cleanup(self):
         if (not self.word == None) and (self.word.Documents.count == 0):
             self.word.Quit()
@@ -3,9 +3,11 @@ from tkinter import filedialog, ttk, messagebox, simpledialog
 from pathlib import Path
 from unicodedata import east_asian_width
 from configparser import ConfigParser
-from lib.text_extractor import TextExtractor
+from lib.text_extractor import TextExtractor, PasswordError
+from lib.extraction_cache import ExtractionCache
 from lib.substring_analyser import SubstringAnalyser
 from threading import Thread
+from queue import Queue, Empty
 from win32com import client
 
 class GUI(tk.Frame):
@@ -28,7 +30,10 @@ class GUI(tk.Frame):
 
         self.last_loc = self.config['input_path']
         self.files = []
-        self.te = TextExtractor()
+        cache = None
+        if self.config['cache_path']:
+            cache = ExtractionCache(self.config['cache_path'], self.config.getint('cache_mb') * 1024 * 1024, TextExtractor.VERSION)
+        self.te = TextExtractor(cache, page_workers=self.config.getint('page_workers'))
 
         # OPTION VARIABLES #
         self.spaced = tk.BooleanVar()
@@ -113,7 +118,7 @@ class GUI(tk.Frame):
 
         # PROGRESS BAR #
         input_frame.grid_rowconfigure(1, weight=1)
-        self.progress_bar = ttk.Progressbar(input_frame, mode='indeterminate', orient='horizontal')
+        self.progress_bar = ttk.Progressbar(input_frame, mode='determinate', orient='horizontal')
         self.progress_bar.grid(column=0, row=3, sticky='ew', columnspan=2)
 
     def create_menus(self):
@@ -153,25 +158,54 @@ class GUI(tk.Frame):
                     , message='Text appears to be spaced (not Japanese). Set to spaced processing?')
                 self.spaced.set(spaced)
                 break
+        self.progress = Queue()
         t = Thread(target=self.create_sa)
         t.start()
+        self.show_progress(t)
 
     def create_sa(self):
         self.go_button.config(state='disabled')
-        self.progress_bar.start()
         self.sa = SubstringAnalyser(spaced=self.spaced.get()
                                 , min_occurrences=self.min_occurrences.get()
-                                , min_length=self.min_length.get())
+                                , min_length=self.min_length.get()
+                                , engine=self.config['engine']
+                                , mode=self.config['mode']
+                                , max_workers=self.config.getint('max_workers') or None
+                                , index_path=self.config['index_path'] or None
+                                , observer=self.progress.put
+                                , top_k=self.config.getint('top_k') or None
+                                , score=self.config['score']
+                                , termhood=self.config['termhood']
+                                , shard_size=self.config.getint('shard_size') or None
+                                , max_term_length=self.config.getint('max_term_length'))
         try:
             self.sa.load(list([(f['path'].name, f['text']) for f in self.files]))
             self.sa.load_common()
         except Exception as e:
             messagebox.showerror('Error analysing files', 'Error analysing files:\n{}'.format(e))
             return
-        finally:
-            self.progress_bar.stop()
         self.save()
 
+    def show_progress(self, thread):
+        '''Moves the progress bar on with the analyser's events, polling the progress queue from the Tk thread
+until the analysis thread ends. The texts and then the common substrings fill the bar once, and the sheets
+of the output fill it again as they are saved.'''
+        while True:
+            try:
+                event = self.progress.get_nowait()
+            except Empty:
+                break
+            if event['stage'] == 'repeats':
+                self.progress_bar.config(maximum=event['total'] + 1, value=event['done'])
+            elif event['stage'] == 'common':
+                self.progress_bar.config(value=self.progress_bar['maximum'])
+            else:
+                self.progress_bar.config(maximum=event['total'], value=event['done'])
+        if thread.is_alive():
+            self.root.after(100, self.show_progress, thread)
+        else:
+            self.progress_bar.config(value=0)
+
     def setup_context_menu(self):
         
         def select_and_context(e):
@@ -197,26 +231,63 @@ class GUI(tk.Frame):
         if filepath == '': return
         if isinstance(filepath, str):
             filepath = (filepath,)
-        for f in filepath:
-            f = Path(f)
+        filepath = [Path(f) for f in filepath]
+        self.last_loc = str(filepath[-1].root)
+        results = Queue()
+        self.progress_bar.config(maximum=len(filepath), value=0)
+        Thread(target=self.extract_many, args=(filepath, results), daemon=True).start()
+        self.add_extracted(results, [])
+
+    def extract_many(self, filepaths, results):
+        '''Extracts files in worker processes, off the Tk thread, and puts each result in the results queue.'''
+        try:
+            for result in self.te.extract_many(filepaths, max_workers=self.config.getint('max_workers') or None):
+                results.put(result)
+        except Exception as e:
+            results.put((None, None, e))
+        finally:
+            results.put(None)
+
+    def add_extracted(self, results, locked):
+        '''Adds files from the results queue as they are extracted, polling it from the Tk thread until the
+last one. Files which need a password are kept in locked, and asked for once the others are added.'''
+        while True:
+            try:
+                result = results.get_nowait()
+            except Empty:
+                self.root.after(100, self.add_extracted, results, locked)
+                return
+            if result == None:
+                break
+            self.progress_bar.step(1)
+            f, text, error = result
+            if error == None:
+                self.add_file(f, text)
+            elif isinstance(error, PasswordError):
+                locked.append(f)
+            else:
+                messagebox.showerror('Error opening file', 'Error opening file "{}":\n{}'.format(f.name if f else '', error))
+        self.progress_bar.config(value=0)
+        for f in locked:
             self.extract_text(f)
-            self.last_loc = str(f.root)
         self.te.cleanup()
 
+    def add_file(self, f, text):
+        self.files.append({'path' : f, 'text' : text})
+        self.input_box.insert('end', '{} ({})'.format(f.name, f))
+        self.go_button.config(state='active')
+
     def extract_text(self, f, password=''):
         try:
             text = self.te.extract_text(f, password)
-            self.files.append({'path' : f, 'text' : text})
-            self.input_box.insert('end', '{} ({})'.format(f.name, f))
-            self.go_button.config(state='active')
+            self.add_file(f, text)
+        except PasswordError:
+            password = simpledialog.askstring('Incorrect password', 'Enter password for {}:'.format(f.name))
+            if password == None:
+                return
+            self.extract_text(f, password)
         except Exception as e:
-            if e.args[0] == 'Incorrect password.':
-                password = simpledialog.askstring('Incorrect password', 'Enter password for {}:'.format(f.name))
-                if password == None:
-                    return
-                self.extract_text(f, password)
-            else:
-                messagebox.showerror('Error opening file', 'Error opening file "{}":\n{}'.format(f.name, e))
+            messagebox.showerror('Error opening file', 'Error opening file "{}":\n{}'.format(f.name, e))
 
     def delete(self, event=None):
         while self.input_box.curselection() != ():
@@ -234,7 +305,6 @@ class GUI(tk.Frame):
         retry = True
         while retry:
             try:
-                self.progress_bar.start()
                 self.sa.save_output(filepath)
                 retry = False
             except PermissionError:
@@ -245,7 +315,6 @@ class GUI(tk.Frame):
             except Exception as e:
                 messagebox.showerror('Error saving file', 'Error saving file:\n{}'.format(e))
             finally:
-                self.progress_bar.stop()
                 self.go_button.config(state='active')
         yesopen = messagebox.askyesno(title='Output', message='Output saved to {}. Open in Excel?'.format(filepath.name))
         if yesopen:
@@ -0,0 +1,58 @@
+from array import array
+from threading import Lock
+import re
+
+class Vocabulary():
+    '''Interns tokens as dense integer ids, so spaced texts are stored and indexed as arrays of
+4-byte ints instead of lists of strings. One vocabulary is shared by all the texts of an
+analyser, so equal tokens get equal ids across documents.'''
+
+    def __init__(self):
+        self.ids = {}
+        self.tokens = []
+        self.lock = Lock()
+
+    def encode(self, tokens):
+        '''Returns an array('i') with the id of every token, adding new tokens as they are seen.'''
+        encoded = array('i')
+        with self.lock: # Documents are encoded from several threads
+            ids = self.ids
+            for t in tokens:
+                i = ids.get(t)
+                if i is None:
+                    i = ids[t] = len(self.tokens)
+                    self.tokens.append(t)
+                encoded.append(i)
+        return encoded
+
+    def decode(self, ids):
+        '''Returns the list of tokens for a sequence of ids.'''
+        tokens = self.tokens
+        return [tokens[i] for i in ids]
+
+def tokenize(pattern, text):
+    '''Yields the same tokens as re.split(pattern, text) for a pattern with one group,
+without building the whole list first.'''
+    last = 0
+    for m in re.finditer(pattern, text):
+        yield text[last:m.start()]
+        yield m.group(1)
+        last = m.end()
+    yield text[last:]
+
+def tokenize_blocks(pattern, blocks):
+    '''Yields the same tokens as tokenize(pattern, ''.join(blocks)), reading the blocks one at a time.
+The text after the last match that ends before the end of a block, which the next block can extend,
+is carried over to it.'''
+    rest = ''
+    for block in blocks:
+        text = rest + block
+        last = 0
+        for m in re.finditer(pattern, text):
+            if m.end() == len(text): # The next block can extend the match
+                break
+            yield text[last:m.start()]
+            yield m.group(1)
+            last = m.end()
+        rest = text[last:]
+    yield from tokenize(pattern, rest)
@@ -0,0 +1,103 @@
+'''Checks that the different ways of finding repeats and common substrings give the same results:
+the stree and suffix_array engines in every mode, common substrings kept up to date as texts are
+added and removed against those found afresh, and texts analysed in shards, and their common substrings,
+against the same texts analysed whole, up to max_term_length.
+
+Run from the repository root:
+    python -m pytest tests'''
+from lib.substring_analyser import SubstringAnalyser, SuffixArrayEngine, MODES, TERMHOOD
+import random
+import pytest
+
+def corpus(spaced, documents=3, size=400, seed=0):
+    '''Returns documents random texts with plenty of repeats, made of a few words (or characters, unspaced)
+and punctuation, always the same for a seed.'''
+    rng = random.Random(seed)
+    if spaced:
+        words = ['the', 'cat', 'sat', 'on', 'a', 'mat', 'mat.', 'dog', 'ran,', 'far', 'away\n', '(soft)']
+        return [' '.join(rng.choice(words) for _ in range(size // 4)) for _ in range(documents)]
+    return [''.join(rng.choice('ありがとう、。 猫犬') for _ in range(size)) for _ in range(documents)]
+
+def analyser(**options):
+    '''Returns a SubstringAnalyser which analyses in this thread and prints nothing.'''
+    return SubstringAnalyser(max_workers=1, observer=lambda event: None, **options)
+
+def results(sa):
+    '''Returns the results of every loaded text and the common substrings, sorted, as the engines
+can order ties differently.'''
+    texts = [sorted(d['results']) for d in sa.data]
+    common = sorted((substring, list(idxs)) for substring, idxs in sa.common['results'])
+    return texts, common
+
+@pytest.mark.parametrize('spaced', [False, True])
+@pytest.mark.parametrize('mode', MODES)
+def test_engines(spaced, mode):
+    texts = corpus(spaced)
+    found = []
+    for engine in ('stree', 'suffix_array'):
+        sa = analyser(spaced=spaced, mode=mode, engine=engine, min_length=1)
+        sa.load([(str(i), t) for i, t in enumerate(texts)])
+        sa.load_common()
+        found.append(results(sa))
+    assert found[0] == found[1]
+    assert found[0][0][0] and found[0][1] # Something was found to compare
+
+@pytest.mark.parametrize('spaced', [False, True])
+@pytest.mark.parametrize('mode', MODES)
+def test_incremental(spaced, mode):
+    texts = corpus(spaced, documents=5, seed=1)
+    sa = analyser(spaced=spaced, mode=mode, incremental=True)
+    fresh = analyser(spaced=spaced, mode=mode)
+    for i, t in enumerate(texts[:3]):
+        sa.load((str(i), t))
+        sa.load_common()
+    sa.load([('3', texts[3]), ('4', texts[4])])
+    sa.load_common()
+    sa.remove(1)
+    sa.remove(3)
+    sa.load_common()
+    sa.load(('5', texts[1]))
+    sa.load_common()
+    fresh.load([(str(i), texts[i]) for i in (0, 2, 3, 1)])
+    fresh.load_common()
+    assert sa.common['results']
+    assert results(sa)[1] == results(fresh)[1]
+
+@pytest.mark.parametrize('spaced', [False, True])
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('termhood', TERMHOOD)
+def test_sharded(spaced, mode, termhood):
+    text = corpus(spaced, documents=1, size=4000, seed=2)[0]
+    options = {'spaced' : spaced, 'mode' : mode, 'termhood' : termhood, 'engine' : 'suffix_array', 'min_length' : 1}
+    sharded = analyser(shard_size=500, max_term_length=6, **options)
+    sharded.load([('text', text), ('blocks', iter([text[i:i + 333] for i in range(0, len(text), 333)]))])
+    assert all(sharded.sharded(d['text']) for d in sharded.data)
+    whole = analyser(**options)
+    encoded = whole.encode(text)
+    engine = SuffixArrayEngine(encoded)
+    engine.max_depth = 6 # The repeats a sharded text is analysed for
+    expected = sorted(whole.index_repeats(encoded, engine=engine).query(1, 2))
+    assert expected
+    assert sorted(sharded.data[0]['results']) == expected
+    assert sorted(sharded.data[1]['results']) == expected
+    assert sharded.data[0]['key'] == sharded.data[1]['key']
+
+@pytest.mark.parametrize('spaced', [False, True])
+@pytest.mark.parametrize('mode', MODES)
+def test_sharded_common(spaced, mode):
+    texts = corpus(spaced, documents=3, size=1200, seed=3)
+    sharded = analyser(spaced=spaced, mode=mode, engine='suffix_array', shard_size=250, max_term_length=5)
+    sharded.load([(str(i), t) for i, t in enumerate(texts)])
+    sharded.load_common()
+    whole = analyser(spaced=spaced, mode=mode, engine='suffix_array')
+    encoded = [whole.encode(t) for t in texts]
+    engine = SuffixArrayEngine(encoded, gst=True)
+    counts = whole.counts()
+    nodes = []
+    for idx, depth, idxs in engine.common(mode):
+        label = whole.decode(engine.label(idx, depth))
+        if depth <= 5 and sum(1 for s in engine.label(idx, depth) if counts(s)) >= whole.min_length:
+            nodes.append(((label, whole.common_label(label)), depth, idxs))
+    expected = sorted((substring, list(idxs)) for substring, idxs in whole.common_results(nodes))
+    assert expected
+    assert results(sharded)[1] == expected
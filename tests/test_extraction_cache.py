@@ -0,0 +1,60 @@
+'''Checks that ExtractionCache returns cached texts only while the file and the extractor version are the
+same, and hashes a file again only when its record can't be reused.
+
+Run from the repository root:
+    python -m pytest tests'''
+from lib.extraction_cache import ExtractionCache
+import os
+import pickle
+
+def source(tmp_path, text='some text'):
+    '''Returns the path of a file holding text.'''
+    path = tmp_path / 'source.txt'
+    path.write_text(text, encoding='utf-8')
+    return path
+
+def test_hit_and_miss(tmp_path):
+    path = source(tmp_path)
+    cache = ExtractionCache(tmp_path / 'cache')
+    assert cache.extract(path, lambda: 'extracted') == 'extracted'
+    assert cache.extract(path, lambda: 'extracted again') == 'extracted'
+    assert cache.stats() == {'hits' : 1, 'misses' : 1, 'hashed' : 1}
+
+def test_changed_file(tmp_path):
+    path = source(tmp_path)
+    cache = ExtractionCache(tmp_path / 'cache')
+    cache.extract(path, lambda: 'old')
+    path.write_text('other text', encoding='utf-8')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9)) # In case the clock didn't move on
+    assert cache.extract(path, lambda: 'new') == 'new'
+    assert cache.stats() == {'hits' : 0, 'misses' : 2, 'hashed' : 2}
+
+def test_version(tmp_path):
+    path = source(tmp_path)
+    ExtractionCache(tmp_path / 'cache', version=1).extract(path, lambda: 'v1 text')
+    cache = ExtractionCache(tmp_path / 'cache', version=2)
+    assert cache.extract(path, lambda: 'v2 text') == 'v2 text'
+    assert cache.stats() == {'hits' : 0, 'misses' : 1, 'hashed' : 1}
+    # Each version finds its own text
+    assert ExtractionCache(tmp_path / 'cache', version=1).extract(path, lambda: 'missed') == 'v1 text'
+    assert cache.extract(path, lambda: 'missed') == 'v2 text'
+
+def test_eviction(tmp_path):
+    cache = ExtractionCache(tmp_path / 'cache', max_bytes=1)
+    cache.put('a', 'first')
+    cache.put('b', 'second')
+    assert cache.get('a') is None
+    assert cache.get('b') is None # Over max_bytes alone
+    cache.max_bytes = 1024
+    cache.put('a', 'first')
+    cache.put('b', 'second')
+    assert (cache.get('a'), cache.get('b')) == ('first', 'second')
+
+def test_pickle(tmp_path):
+    cache = ExtractionCache(tmp_path / 'cache', version=3)
+    cache.extract(source(tmp_path), lambda: 'text')
+    copy = pickle.loads(pickle.dumps(cache))
+    assert (copy.path, copy.version, copy.stats()) == (cache.path, 3, {'hits' : 0, 'misses' : 0, 'hashed' : 0})
+    cache.merge({'hits' : 2, 'misses' : 0, 'hashed' : 1})
+    assert cache.stats() == {'hits' : 2, 'misses' : 1, 'hashed' : 2}